@@ -4,6 +4,7 @@ from wallet import WalletSynchronizer
 from wallet_factory import WalletFactory as Wallet
 from verifier import WalletVerifier
 from interface import Interface, pick_random_server, DEFAULT_SERVERS
+from interface_pool import InterfacePool
 from simple_config import SimpleConfig
 import bitcoin
 from bitcoin import Transaction, EC_KEY, is_valid
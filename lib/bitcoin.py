@@ -17,8 +17,9 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 
-import hashlib, base64, ecdsa, re
-from util import print_error
+import hashlib, base64, ecdsa, re, struct
+from util import print_error, load_library, LRUCache
+from hashes import ripemd160
 
 def rev_hex(s):
     return s.decode('hex')[::-1].encode('hex')
@@ -39,6 +40,26 @@ def var_int(i):
     else:
         return "ff"+int_to_hex(i,8)
 
+def var_int_bytes(i):
+    if i<0xfd:
+        return chr(i)
+    elif i<=0xffff:
+        return '\xfd' + struct.pack('<H', i)
+    elif i<=0xffffffff:
+        return '\xfe' + struct.pack('<I', i)
+    else:
+        return '\xff' + struct.pack('<Q', i)
+
+def op_push_bytes(i):
+    if i<0x4c:
+        return chr(i)
+    elif i<0xff:
+        return '\x4c' + chr(i)
+    elif i<0xffff:
+        return '\x4d' + struct.pack('<H', i)
+    else:
+        return '\x4e' + struct.pack('<I', i)
+
 def op_push(i):
     if i<0x4c:
         return int_to_hex(i)
@@ -107,29 +128,49 @@ def i2o_ECPublicKey(pubkey, compressed=False):
 ############ functions from pywallet ##################### 
 
 def hash_160(public_key):
-    try:
-        md = hashlib.new('ripemd160')
-        md.update(hashlib.sha256(public_key).digest())
-        return md.digest()
-    except:
-        import ripemd
-        md = ripemd.new(hashlib.sha256(public_key).digest())
-        return md.digest()
+    return ripemd160(hashlib.sha256(public_key).digest())
 
 
 def public_key_to_bc_address(public_key):
     h160 = hash_160(public_key)
     return hash_160_to_bc_address(h160)
 
+# base58 conversions are cached, because the same addresses are
+# converted again and again by the wallet and the GUI
+hash_addresses = LRUCache(10000)     # (addrtype, hash_160) -> address
+address_hashes = LRUCache(10000)     # address -> (addrtype, hash_160)
+address_scripts = LRUCache(10000)    # address -> output script
+
 def hash_160_to_bc_address(h160, addrtype = 0):
-    vh160 = chr(addrtype) + h160
-    h = Hash(vh160)
-    addr = vh160 + h[0:4]
-    return b58encode(addr)
+    addr = hash_addresses.get((addrtype, h160))
+    if addr is None:
+        vh160 = chr(addrtype) + h160
+        h = Hash(vh160)
+        addr = b58encode(vh160 + h[0:4])
+        hash_addresses.put((addrtype, h160), addr)
+    return addr
 
 def bc_address_to_hash_160(addr):
-    bytes = b58decode(addr, 25)
-    return ord(bytes[0]), bytes[1:21]
+    result = address_hashes.get(addr)
+    if result is None:
+        bytes = b58decode(addr, 25)
+        result = ord(bytes[0]), bytes[1:21]
+        address_hashes.put(addr, result)
+    return result
+
+def address_to_script(addr):
+    """ the output script paying to addr, as bytes """
+    script = address_scripts.get(addr)
+    if script is None:
+        addrtype, hash_160 = bc_address_to_hash_160(addr)
+        if addrtype == 0:
+            script = '\x76\xa9\x14' + hash_160 + '\x88\xac'    # op_dup, op_hash_160, push 0x14 bytes, op_equalverify, op_checksig
+        elif addrtype == 5:
+            script = '\xa9\x14' + hash_160 + '\x87'            # op_hash_160, push 0x14 bytes, op_equal
+        else:
+            raise BaseException("unknown address type: %d"%addrtype)
+        address_scripts.put(addr, script)
+    return script
 
 def encode_point(pubkey, compressed=False):
     order = generator_secp256k1.order()
@@ -144,46 +185,51 @@ def encode_point(pubkey, compressed=False):
 __b58chars = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
 __b58base = len(__b58chars)
 
+__b58values = dict((c, i) for i, c in enumerate(__b58chars))
+
+# base58 digits are converted 10 at a time, with a single big-integer
+# operation per group of 10
+__b58chunk = __b58base**10
+
 def b58encode(v):
     """ encode v, which is a string of bytes, to base58."""
 
-    long_value = 0L
-    for (i, c) in enumerate(v[::-1]):
-        long_value += (256**i) * ord(c)
+    long_value = int('0' + v.encode('hex'), 16)
 
-    result = ''
+    result = []
+    while long_value >= __b58chunk:
+        long_value, chunk = divmod(long_value, __b58chunk)
+        for i in xrange(10):
+            chunk, mod = divmod(chunk, __b58base)
+            result.append(__b58chars[mod])
     while long_value >= __b58base:
-        div, mod = divmod(long_value, __b58base)
-        result = __b58chars[mod] + result
-        long_value = div
-    result = __b58chars[long_value] + result
+        long_value, mod = divmod(long_value, __b58base)
+        result.append(__b58chars[mod])
+    result.append(__b58chars[long_value])
+    result.reverse()
 
     # Bitcoin does a little leading-zero-compression:
     # leading 0-bytes in the input become leading-1s
-    nPad = 0
-    for c in v:
-        if c == '\0': nPad += 1
-        else: break
+    nPad = len(v) - len(v.lstrip('\0'))
 
-    return (__b58chars[0]*nPad) + result
+    return (__b58chars[0]*nPad) + ''.join(result)
 
 def b58decode(v, length):
     """ decode v into a string of len bytes."""
     long_value = 0L
-    for (i, c) in enumerate(v[::-1]):
-        long_value += __b58chars.find(c) * (__b58base**i)
+    for i in xrange(0, len(v), 10):
+        chunk = v[i:i+10]
+        value = 0
+        for c in chunk:
+            value = value * __b58base + __b58values.get(c, -1)
+        long_value = long_value * __b58base**len(chunk) + value
 
-    result = ''
-    while long_value >= 256:
-        div, mod = divmod(long_value, 256)
-        result = chr(mod) + result
-        long_value = div
-    result = chr(long_value) + result
+    if long_value < 0:
+        raise ValueError("invalid base58 string")
+    result = '%x' % long_value
+    result = (('0' if len(result) % 2 else '') + result).decode('hex')
 
-    nPad = 0
-    for c in v:
-        if c == __b58chars[0]: nPad += 1
-        else: break
+    nPad = len(v) - len(v.lstrip(__b58chars[0]))
 
     result = chr(0)*nPad + result
     if length is not None and len(result) != length:
@@ -259,8 +305,9 @@ def address_from_private_key(sec):
     return address
 
 
+ADDRESS_RE = re.compile('[1-9A-HJ-NP-Za-km-z]{26,}\\Z')
+
 def is_valid(addr):
-    ADDRESS_RE = re.compile('[1-9A-HJ-NP-Za-km-z]{26,}\\Z')
     if not ADDRESS_RE.match(addr): return False
     try:
         addrtype, h = bc_address_to_hash_160(addr)
@@ -285,21 +332,503 @@ SECP256k1 = ecdsa.curves.Curve("SECP256k1", curve_secp256k1, generator_secp256k1
 
 from ecdsa.util import string_to_number, number_to_string
 
+
+############ EC backends #################################
+#
+# The elliptic curve operations used by Electrum. Public keys are
+# passed as 65-byte uncompressed strings, scalars as numbers.
+#   get_pubkey(secexp)             secexp*G
+#   pubkey_tweak_add(pubkey, z)    pubkey + z*G
+#   pubkeys_tweak_add(pubkey, zs)  [pubkey + z*G for z in zs]
+#   pubkey_tweak_mul(pubkey, z)    z*pubkey
+#   sign(digest, secexp)           (r, s)
+#   verify(digest, r, s, pubkey)   True or False
+
+def point_to_ser(P):
+    return chr(4) + number_to_string(P.x(), _r) + number_to_string(P.y(), _r)
+
+def ser_to_point(ser):
+    if len(ser) != 65 or ser[0] != chr(4):
+        raise BaseException("invalid public key")
+    x = string_to_number(ser[1:33])
+    y = string_to_number(ser[33:])
+    if not curve_secp256k1.contains_point(x, y):
+        raise BaseException("invalid public key")
+    return ecdsa.ellipticcurve.Point(curve_secp256k1, x, y)
+
+
+# Fast fixed-base arithmetic for the pure python backend.
+# Points are in Jacobian coordinates (X, Y, Z), None being the point at
+# infinity. z*G is a sum of precomputed multiples of G (a comb with
+# 4-bit windows), so it needs no doublings, and a batch of points is
+# converted back to affine coordinates with a single inversion.
+
+def jacobian_add_affine(P, Q):
+    """ P + Q, where Q = (x, y) is affine """
+    if P is None:
+        return (Q[0], Q[1], 1)
+    X1, Y1, Z1 = P
+    x2, y2 = Q
+    Z1Z1 = Z1*Z1 % _p
+    H = (x2*Z1Z1 - X1) % _p
+    r = (y2*Z1*Z1Z1 - Y1) % _p
+    if H == 0:
+        if r == 0:
+            return jacobian_double(P)
+        return None
+    HH = H*H % _p
+    HHH = H*HH % _p
+    V = X1*HH % _p
+    X3 = (r*r - HHH - 2*V) % _p
+    Y3 = (r*(V - X3) - Y1*HHH) % _p
+    return (X3, Y3, Z1*H % _p)
+
+def jacobian_double(P):
+    if P is None:
+        return None
+    X, Y, Z = P
+    if Y == 0:
+        return None
+    YY = Y*Y % _p
+    S = 4*X*YY % _p
+    M = 3*X*X % _p
+    X3 = (M*M - 2*S) % _p
+    return (X3, (M*(S - X3) - 8*YY*YY) % _p, 2*Y*Z % _p)
+
+def jacobian_to_affine_batch(points):
+    """ convert a list of points to affine coordinates, with one inversion (Montgomery's trick) """
+    products = []
+    acc = 1
+    for P in points:
+        products.append(acc)
+        if P is not None:
+            acc = acc * P[2] % _p
+    inv = pow(acc, _p - 2, _p)
+    out = [None]*len(points)
+    for i in range(len(points) - 1, -1, -1):
+        P = points[i]
+        if P is None:
+            continue
+        zinv = inv * products[i] % _p
+        inv = inv * P[2] % _p
+        zinv2 = zinv*zinv % _p
+        out[i] = (P[0]*zinv2 % _p, P[1]*zinv2*zinv % _p)
+    return out
+
+_g_table = None
+
+def g_table():
+    """ g_table()[i][d] = d * 16^i * G, in affine coordinates """
+    global _g_table
+    if _g_table is None:
+        rows = []
+        base = (_Gx, _Gy)
+        for i in range(64):
+            row = [None, (base[0], base[1], 1)]
+            for d in range(2, 16):
+                row.append(jacobian_add_affine(row[-1], base))
+            rows.append(row)
+            P = jacobian_add_affine(row[-1], base)    # 16 * base
+            base = jacobian_to_affine_batch([P])[0]
+        flat = jacobian_to_affine_batch([P for row in rows for P in row[1:]])
+        _g_table = [ [None] + flat[15*i:15*(i+1)] for i in range(64) ]
+    return _g_table
+
+def jacobian_mul_g(z):
+    table = g_table()
+    P = None
+    i = 0
+    while z:
+        d = z & 15
+        if d:
+            P = jacobian_add_affine(P, table[i][d])
+        z >>= 4
+        i += 1
+    return P
+
+
+class EcdsaBackend:
+    """ pure python, with the ecdsa module """
+
+    name = 'ecdsa'
+
+    def get_pubkey(self, secexp):
+        x, y = jacobian_to_affine_batch([ jacobian_mul_g(secexp % _r) ])[0]
+        return chr(4) + number_to_string(x, _r) + number_to_string(y, _r)
+
+    def pubkey_tweak_add(self, pubkey, z):
+        return self.pubkeys_tweak_add(pubkey, [z])[0]
+
+    def pubkeys_tweak_add(self, pubkey, tweaks):
+        P = ser_to_point(pubkey)
+        P = (P.x(), P.y())
+        points = [ jacobian_add_affine(jacobian_mul_g(z % _r), P) for z in tweaks ]
+        out = []
+        for Q in jacobian_to_affine_batch(points):
+            if Q is None:
+                raise BaseException("point at infinity")
+            out.append( chr(4) + number_to_string(Q[0], _r) + number_to_string(Q[1], _r) )
+        return out
+
+    def pubkey_tweak_mul(self, pubkey, z):
+        return point_to_ser(ser_to_point(pubkey) * z)
+
+    def sign(self, digest, secexp):
+        private_key = ecdsa.SigningKey.from_secret_exponent( secexp, curve = SECP256k1 )
+        return private_key.sign_digest( digest, sigencode = lambda r, s, order: (r, s) )
+
+    def verify(self, digest, r, s, pubkey):
+        if not (0 < r < _r and 0 < s < _r):
+            return False
+        c = ecdsa.numbertheory.inverse_mod( s, _r )
+        u1 = ( string_to_number(digest) * c ) % _r
+        u2 = ( r * c ) % _r
+        xy = generator_secp256k1 * u1 + ser_to_point(pubkey) * u2
+        return xy != ecdsa.ellipticcurve.INFINITY and xy.x() % _r == r
+
+
+
+class Secp256k1Backend:
+    """ libsecp256k1, with ctypes """
+
+    name = 'secp256k1'
+
+    SECP256K1_CONTEXT_SIGN = (1 << 0) | (1 << 9)
+    SECP256K1_CONTEXT_VERIFY = (1 << 0) | (1 << 8)
+    SECP256K1_EC_UNCOMPRESSED = (1 << 1)
+
+    def __init__(self):
+        from ctypes import c_void_p, c_char_p, c_size_t, c_int, c_uint, POINTER
+        self.lib = lib = load_library('secp256k1', ['libsecp256k1.so.0', 'libsecp256k1.so', 'libsecp256k1.dylib', 'libsecp256k1.dll'])
+        lib.secp256k1_context_create.argtypes = [c_uint]
+        lib.secp256k1_context_create.restype = c_void_p
+        lib.secp256k1_ec_pubkey_create.argtypes = [c_void_p, c_char_p, c_char_p]
+        lib.secp256k1_ec_pubkey_parse.argtypes = [c_void_p, c_char_p, c_char_p, c_size_t]
+        lib.secp256k1_ec_pubkey_serialize.argtypes = [c_void_p, c_char_p, POINTER(c_size_t), c_char_p, c_uint]
+        lib.secp256k1_ec_pubkey_tweak_add.argtypes = [c_void_p, c_char_p, c_char_p]
+        lib.secp256k1_ec_pubkey_tweak_mul.argtypes = [c_void_p, c_char_p, c_char_p]
+        lib.secp256k1_ecdsa_sign.argtypes = [c_void_p, c_char_p, c_char_p, c_char_p, c_void_p, c_void_p]
+        lib.secp256k1_ecdsa_signature_serialize_compact.argtypes = [c_void_p, c_char_p, c_char_p]
+        lib.secp256k1_ecdsa_signature_parse_compact.argtypes = [c_void_p, c_char_p, c_char_p]
+        lib.secp256k1_ecdsa_signature_normalize.argtypes = [c_void_p, c_char_p, c_char_p]
+        lib.secp256k1_ecdsa_verify.argtypes = [c_void_p, c_char_p, c_char_p, c_char_p]
+        for f in [lib.secp256k1_ec_pubkey_create, lib.secp256k1_ec_pubkey_parse, lib.secp256k1_ec_pubkey_serialize,
+                  lib.secp256k1_ec_pubkey_tweak_add, lib.secp256k1_ec_pubkey_tweak_mul, lib.secp256k1_ecdsa_sign,
+                  lib.secp256k1_ecdsa_signature_serialize_compact, lib.secp256k1_ecdsa_signature_parse_compact,
+                  lib.secp256k1_ecdsa_signature_normalize, lib.secp256k1_ecdsa_verify]:
+            f.restype = c_int
+        self.ctx = lib.secp256k1_context_create(self.SECP256K1_CONTEXT_SIGN | self.SECP256K1_CONTEXT_VERIFY)
+        if not self.ctx:
+            raise BaseException("secp256k1_context_create failed")
+
+    def scalar(self, z):
+        z = z % _r
+        if z == 0:
+            raise BaseException("invalid scalar")
+        return number_to_string(z, _r)
+
+    def parse_pubkey(self, ser):
+        import ctypes
+        pubkey = ctypes.create_string_buffer(64)
+        if not self.lib.secp256k1_ec_pubkey_parse(self.ctx, pubkey, ser, len(ser)):
+            raise BaseException("invalid public key")
+        return pubkey
+
+    def serialize_pubkey(self, pubkey):
+        import ctypes
+        out = ctypes.create_string_buffer(65)
+        size = ctypes.c_size_t(65)
+        self.lib.secp256k1_ec_pubkey_serialize(self.ctx, out, ctypes.byref(size), pubkey, self.SECP256K1_EC_UNCOMPRESSED)
+        return out.raw[:size.value]
+
+    def get_pubkey(self, secexp):
+        import ctypes
+        pubkey = ctypes.create_string_buffer(64)
+        if not self.lib.secp256k1_ec_pubkey_create(self.ctx, pubkey, self.scalar(secexp)):
+            raise BaseException("invalid secret")
+        return self.serialize_pubkey(pubkey)
+
+    def pubkey_tweak_add(self, pubkey, z):
+        p = self.parse_pubkey(pubkey)
+        if z % _r and not self.lib.secp256k1_ec_pubkey_tweak_add(self.ctx, p, self.scalar(z)):
+            raise BaseException("secp256k1_ec_pubkey_tweak_add failed")
+        return self.serialize_pubkey(p)
+
+    def pubkeys_tweak_add(self, pubkey, tweaks):
+        import ctypes
+        p = self.parse_pubkey(pubkey)
+        q = ctypes.create_string_buffer(64)
+        out = []
+        for z in tweaks:
+            ctypes.memmove(q, p, 64)
+            if z % _r and not self.lib.secp256k1_ec_pubkey_tweak_add(self.ctx, q, self.scalar(z)):
+                raise BaseException("secp256k1_ec_pubkey_tweak_add failed")
+            out.append( self.serialize_pubkey(q) )
+        return out
+
+    def pubkey_tweak_mul(self, pubkey, z):
+        p = self.parse_pubkey(pubkey)
+        if not self.lib.secp256k1_ec_pubkey_tweak_mul(self.ctx, p, self.scalar(z)):
+            raise BaseException("secp256k1_ec_pubkey_tweak_mul failed")
+        return self.serialize_pubkey(p)
+
+    def sign(self, digest, secexp):
+        import ctypes
+        sig = ctypes.create_string_buffer(64)
+        if not self.lib.secp256k1_ecdsa_sign(self.ctx, sig, digest, self.scalar(secexp), None, None):
+            raise BaseException("secp256k1_ecdsa_sign failed")
+        compact = ctypes.create_string_buffer(64)
+        self.lib.secp256k1_ecdsa_signature_serialize_compact(self.ctx, compact, sig)
+        return string_to_number(compact.raw[0:32]), string_to_number(compact.raw[32:64])
+
+    def verify(self, digest, r, s, pubkey):
+        import ctypes
+        if not (0 < r < _r and 0 < s < _r):
+            return False
+        sig = ctypes.create_string_buffer(64)
+        if not self.lib.secp256k1_ecdsa_signature_parse_compact(self.ctx, sig, number_to_string(r, _r) + number_to_string(s, _r)):
+            return False
+        # libsecp256k1 only accepts low s values
+        self.lib.secp256k1_ecdsa_signature_normalize(self.ctx, sig, sig)
+        return self.lib.secp256k1_ecdsa_verify(self.ctx, sig, digest, self.parse_pubkey(pubkey)) == 1
+
+
+
+class OpenSSLBackend:
+    """ OpenSSL (1.1 or later), with ctypes """
+
+    name = 'openssl'
+
+    NID_secp256k1 = 714
+    POINT_CONVERSION_UNCOMPRESSED = 4
+
+    def __init__(self):
+        import threading
+        from ctypes import c_void_p, c_char_p, c_int, c_size_t, POINTER
+        self.lib = lib = load_library('crypto', ['libcrypto.so.3', 'libcrypto.so.1.1', 'libcrypto.dylib', 'libeay32.dll'])
+        lib.BN_CTX_new.restype = c_void_p
+        lib.BN_bin2bn.argtypes = [c_char_p, c_int, c_void_p]
+        lib.BN_bin2bn.restype = c_void_p
+        lib.BN_bn2bin.argtypes = [c_void_p, c_char_p]
+        lib.BN_num_bits.argtypes = [c_void_p]
+        lib.BN_free.argtypes = [c_void_p]
+        lib.EC_GROUP_new_by_curve_name.argtypes = [c_int]
+        lib.EC_GROUP_new_by_curve_name.restype = c_void_p
+        lib.EC_POINT_new.argtypes = [c_void_p]
+        lib.EC_POINT_new.restype = c_void_p
+        lib.EC_POINT_free.argtypes = [c_void_p]
+        lib.EC_POINT_mul.argtypes = [c_void_p, c_void_p, c_void_p, c_void_p, c_void_p, c_void_p]
+        lib.EC_POINT_oct2point.argtypes = [c_void_p, c_void_p, c_char_p, c_size_t, c_void_p]
+        lib.EC_POINT_point2oct.argtypes = [c_void_p, c_void_p, c_int, c_char_p, c_size_t, c_void_p]
+        lib.EC_POINT_point2oct.restype = c_size_t
+        lib.EC_KEY_new_by_curve_name.argtypes = [c_int]
+        lib.EC_KEY_new_by_curve_name.restype = c_void_p
+        lib.EC_KEY_free.argtypes = [c_void_p]
+        lib.EC_KEY_set_private_key.argtypes = [c_void_p, c_void_p]
+        lib.EC_KEY_set_public_key.argtypes = [c_void_p, c_void_p]
+        lib.ECDSA_do_sign.argtypes = [c_char_p, c_int, c_void_p]
+        lib.ECDSA_do_sign.restype = c_void_p
+        lib.ECDSA_do_verify.argtypes = [c_char_p, c_int, c_void_p, c_void_p]
+        lib.ECDSA_SIG_new.restype = c_void_p
+        lib.ECDSA_SIG_free.argtypes = [c_void_p]
+        lib.ECDSA_SIG_get0.argtypes = [c_void_p, POINTER(c_void_p), POINTER(c_void_p)]
+        lib.ECDSA_SIG_get0.restype = None
+        lib.ECDSA_SIG_set0.argtypes = [c_void_p, c_void_p, c_void_p]
+        self.group = lib.EC_GROUP_new_by_curve_name(self.NID_secp256k1)
+        if not self.group:
+            raise BaseException("OpenSSL does not support secp256k1")
+        # a BN_CTX must not be shared between threads
+        self.local = threading.local()
+
+    def get_ctx(self):
+        ctx = getattr(self.local, 'ctx', None)
+        if ctx is None:
+            ctx = self.local.ctx = self.lib.BN_CTX_new()
+        return ctx
+
+    def bn(self, z):
+        return self.lib.BN_bin2bn(number_to_string(z % _r, _r), 32, None)
+
+    def bn_to_number(self, bn):
+        import ctypes
+        buf = ctypes.create_string_buffer((self.lib.BN_num_bits(bn) + 7)/8)
+        self.lib.BN_bn2bin(bn, buf)
+        return string_to_number(buf.raw) if buf.raw else 0
+
+    def new_point(self, ser=None):
+        point = self.lib.EC_POINT_new(self.group)
+        if ser is not None and not self.lib.EC_POINT_oct2point(self.group, point, ser, len(ser), self.get_ctx()):
+            self.lib.EC_POINT_free(point)
+            raise BaseException("invalid public key")
+        return point
+
+    def point_to_ser(self, point):
+        import ctypes
+        out = ctypes.create_string_buffer(65)
+        n = self.lib.EC_POINT_point2oct(self.group, point, self.POINT_CONVERSION_UNCOMPRESSED, out, 65, self.get_ctx())
+        if n != 65:
+            raise BaseException("point at infinity")
+        return out.raw
+
+    def mul(self, g_scalar, point, q_scalar):
+        """ return g_scalar*G + q_scalar*point """
+        lib = self.lib
+        result = self.new_point()
+        n = self.bn(g_scalar) if g_scalar is not None else None
+        q = self.bn(q_scalar) if q_scalar is not None else None
+        try:
+            if not lib.EC_POINT_mul(self.group, result, n, point, q, self.get_ctx()):
+                raise BaseException("EC_POINT_mul failed")
+            return self.point_to_ser(result)
+        finally:
+            if n: lib.BN_free(n)
+            if q: lib.BN_free(q)
+            lib.EC_POINT_free(result)
+
+    def get_pubkey(self, secexp):
+        return self.mul(secexp, None, None)
+
+    def pubkey_tweak_add(self, pubkey, z):
+        point = self.new_point(pubkey)
+        try:
+            return self.mul(z, point, 1)
+        finally:
+            self.lib.EC_POINT_free(point)
+
+    def pubkeys_tweak_add(self, pubkey, tweaks):
+        point = self.new_point(pubkey)
+        try:
+            return [ self.mul(z, point, 1) for z in tweaks ]
+        finally:
+            self.lib.EC_POINT_free(point)
+
+    def pubkey_tweak_mul(self, pubkey, z):
+        point = self.new_point(pubkey)
+        try:
+            return self.mul(None, point, z)
+        finally:
+            self.lib.EC_POINT_free(point)
+
+    def sign(self, digest, secexp):
+        import ctypes
+        lib = self.lib
+        key = lib.EC_KEY_new_by_curve_name(self.NID_secp256k1)
+        priv = self.bn(secexp)
+        sig = None
+        try:
+            lib.EC_KEY_set_private_key(key, priv)
+            sig = lib.ECDSA_do_sign(digest, len(digest), key)
+            if not sig:
+                raise BaseException("ECDSA_do_sign failed")
+            r = ctypes.c_void_p()
+            s = ctypes.c_void_p()
+            lib.ECDSA_SIG_get0(sig, ctypes.byref(r), ctypes.byref(s))
+            return self.bn_to_number(r), self.bn_to_number(s)
+        finally:
+            if sig: lib.ECDSA_SIG_free(sig)
+            lib.BN_free(priv)
+            lib.EC_KEY_free(key)
+
+    def verify(self, digest, r, s, pubkey):
+        lib = self.lib
+        if not (0 < r < _r and 0 < s < _r):
+            return False
+        point = self.new_point(pubkey)
+        key = lib.EC_KEY_new_by_curve_name(self.NID_secp256k1)
+        sig = lib.ECDSA_SIG_new()
+        try:
+            lib.EC_KEY_set_public_key(key, point)
+            lib.ECDSA_SIG_set0(sig, self.bn(r), self.bn(s))   # sig owns r and s
+            return lib.ECDSA_do_verify(digest, len(digest), sig, key) == 1
+        finally:
+            lib.ECDSA_SIG_free(sig)
+            lib.EC_KEY_free(key)
+            lib.EC_POINT_free(point)
+
+
+
+ec_backends = {
+    'secp256k1': Secp256k1Backend,
+    'openssl': OpenSSLBackend,
+    'ecdsa': EcdsaBackend,
+}
+ec_backends_order = ['secp256k1', 'openssl', 'ecdsa']
+_ec_backend = None
+
+def set_ec_backend(name=None):
+    """ select the EC backend. the default is the fastest one available. """
+    global _ec_backend
+    for n in ([name] if name else ec_backends_order):
+        if n not in ec_backends:
+            raise BaseException("Unknown EC backend: %s"%n)
+        try:
+            _ec_backend = ec_backends[n]()
+        except BaseException, e:
+            if name: raise
+            print_error("EC backend %s not available:"%n, e)
+            continue
+        print_error("EC backend:", n)
+        return _ec_backend
+
+def ec_backend():
+    if _ec_backend is None:
+        set_ec_backend()
+    return _ec_backend
+
+########### end EC backends ##############################
+
+def verify_der(digest, sig, pubkey):
+    """ check a DER signature. pubkey is serialized, compressed or not """
+    try:
+        r, s = ecdsa.util.sigdecode_der( sig, _r )
+        if len(pubkey) == 33:
+            pubkey = decompress_pubkey(pubkey)
+    except BaseException:
+        return False
+    return ec_backend().verify( digest, r, s, pubkey )
+
+def decompress_pubkey(pubkey):
+    import msqr
+    x = string_to_number(pubkey[1:])
+    beta = msqr.modular_sqrt( (x*x*x + _b) % _p, _p )
+    y = beta if (beta - ord(pubkey[0])) % 2 == 0 else _p - beta
+    return chr(4) + number_to_string(x, _r) + number_to_string(y, _r)
+
+def sign_digest(item):
+    """ return the DER signature of digest, checked against pubkey if it is not None. runs in worker processes """
+    digest, secexp, pubkey = item
+    r, s = ec_backend().sign( digest, secexp )
+    sig = ecdsa.util.sigencode_der( r, s, _r )
+    if pubkey is not None:
+        assert verify_der( digest, sig, pubkey )
+    return sig
+
 def msg_magic(message):
     return "\x18Bitcoin Signed Message:\n" + chr( len(message) ) + message
 
 
+class EC_PUBKEY(object):
+    def __init__( self, ser ):
+        # ser is the uncompressed serialization; the point is not checked again
+        self.ser = ser
+        self.point = ecdsa.ellipticcurve.Point( curve_secp256k1, string_to_number(ser[1:33]), string_to_number(ser[33:]) )
+
+
 class EC_KEY(object):
     def __init__( self, secret ):
-        self.pubkey = ecdsa.ecdsa.Public_key( generator_secp256k1, generator_secp256k1 * secret )
-        self.privkey = ecdsa.ecdsa.Private_key( self.pubkey, secret )
+        self.pubkey = EC_PUBKEY( ec_backend().get_pubkey(secret) )
         self.secret = secret
 
+    def sign(self, digest):
+        """ return the DER signature of digest """
+        r, s = ec_backend().sign( digest, self.secret )
+        return ecdsa.util.sigencode_der( r, s, _r )
+
     def sign_message(self, message, compressed, address):
-        private_key = ecdsa.SigningKey.from_secret_exponent( self.secret, curve = SECP256k1 )
-        public_key = private_key.get_verifying_key()
-        signature = private_key.sign_digest( Hash( msg_magic(message) ), sigencode = ecdsa.util.sigencode_string )
-        assert public_key.verify_digest( signature, Hash( msg_magic(message) ), sigdecode = ecdsa.util.sigdecode_string)
+        h = Hash( msg_magic(message) )
+        r, s = ec_backend().sign( h, self.secret )
+        assert ec_backend().verify( h, r, s, self.pubkey.ser )
+        signature = ecdsa.util.sigencode_string( r, s, _r )
         for i in range(4):
             sig = base64.b64encode( chr(27 + i + (4 if compressed else 0)) + signature )
             try:
@@ -338,20 +867,21 @@ class EC_KEY(object):
         alpha = ( x * x * x  + curve.a() * x + curve.b() ) % curve.p()
         beta = msqr.modular_sqrt(alpha, curve.p())
         y = beta if (beta - recid) % 2 == 0 else curve.p() - beta
-        # 1.4 the constructor checks that nR is at infinity
-        R = ellipticcurve.Point(curve, x, y, order)
+        # 1.4 R is on the curve; secp256k1 has no cofactor, so nR is at infinity
+        R = chr(4) + number_to_string(x, order) + number_to_string(y, order)
         # 1.5 compute e from message:
         h = Hash( msg_magic(message) )
         e = string_to_number(h)
         minus_e = -e % order
-        # 1.6 compute Q = r^-1 (sR - eG)
+        # 1.6 compute Q = r^-1 (sR - eG) = (s/r) R + (-e/r) G
         inv_r = numbertheory.inverse_mod(r,order)
-        Q = inv_r * ( s * R + minus_e * G )
-        public_key = ecdsa.VerifyingKey.from_public_point( Q, curve = SECP256k1 )
+        backend = ec_backend()
+        Q = backend.pubkey_tweak_add( backend.pubkey_tweak_mul( R, s * inv_r ), minus_e * inv_r )
         # check that Q is the public key
-        public_key.verify_digest( sig[1:], h, sigdecode = ecdsa.util.sigdecode_string)
+        if not backend.verify( h, r, s, Q ):
+            raise BaseException("Bad signature")
         # check that we get the original signing address
-        addr = public_key_to_bc_address( encode_point(public_key, compressed) )
+        addr = public_key_to_bc_address( GetPubKey( EC_PUBKEY(Q), compressed ) )
         if address != addr:
             raise BaseException("Bad signature")
 
@@ -397,15 +927,14 @@ def CKD_prime(K, c, n):
     from ecdsa.util import string_to_number, number_to_string
     order = generator_secp256k1.order()
 
-    K_public_key = ecdsa.VerifyingKey.from_string( K, curve = SECP256k1 )
-    K_compressed = GetPubKey(K_public_key.pubkey,True)
+    K_public_key = EC_PUBKEY( chr(4) + K )
+    K_compressed = GetPubKey(K_public_key,True)
 
     I = hmac.new(c, K_compressed + rev_hex(int_to_hex(n,4)).decode('hex'), hashlib.sha512).digest()
 
-    #pubkey = ecdsa.ecdsa.Public_key( generator_secp256k1, string_to_number(I[0:32]) * K_public_key.pubkey.point )
-    public_key = ecdsa.VerifyingKey.from_public_point( string_to_number(I[0:32]) * K_public_key.pubkey.point, curve = SECP256k1 )
-    K_n = public_key.to_string()
-    K_n_compressed = GetPubKey(public_key.pubkey,True)
+    public_key = EC_PUBKEY( ec_backend().pubkey_tweak_mul( K_public_key.ser, string_to_number(I[0:32]) ) )
+    K_n = public_key.ser[1:]
+    K_n_compressed = GetPubKey(public_key,True)
     c_n = I[32:]
 
     return K_n, K_n_compressed, c_n
@@ -425,10 +954,8 @@ class ElectrumSequence:
 
     @classmethod
     def mpk_from_seed(klass, seed):
-        curve = SECP256k1
         secexp = klass.stretch_key(seed)
-        master_private_key = ecdsa.SigningKey.from_secret_exponent( secexp, curve = SECP256k1 )
-        master_public_key = master_private_key.get_verifying_key().to_string().encode('hex')
+        master_public_key = ec_backend().get_pubkey(secexp)[1:].encode('hex')
         return master_public_key
 
     @classmethod
@@ -452,14 +979,31 @@ class ElectrumSequence:
             address = Transaction.multisig_script([pubkey1, pubkey2], 2)["address"]
         return address
 
+    def get_addresses(self, for_change, start, count):
+        """ return the addresses of a range of indices, derived in one batch """
+        return [ address for pubkeys, address, redeemScript in self.get_keys(for_change, start, count) ]
+
+    def get_keys(self, for_change, start, count):
+        """ return (public keys, address, redeemScript) for a range of indices, derived in one batch """
+        pubkeys1 = self.get_pubkeys(for_change, start, count)
+        if not self.is_p2sh:
+            return [ ([pubkey], public_key_to_bc_address( pubkey.decode('hex') ), None) for pubkey in pubkeys1 ]
+        pubkeys2 = self.get_pubkeys(for_change, start, count, use_mpk2=True)
+        out = []
+        for pubkey1, pubkey2 in zip(pubkeys1, pubkeys2):
+            script = Transaction.multisig_script([pubkey1, pubkey2], 2)
+            out.append( ([pubkey1, pubkey2], script["address"], script["redeemScript"]) )
+        return out
+
     def get_pubkey(self, sequence, use_mpk2=False):
-        curve = SECP256k1
         mpk = self.mpk2 if use_mpk2 else self.master_public_key
         z = self.get_sequence(sequence, mpk)
-        master_public_key = ecdsa.VerifyingKey.from_string( mpk.decode('hex'), curve = SECP256k1 )
-        pubkey_point = master_public_key.pubkey.point + z*curve.generator
-        public_key2 = ecdsa.VerifyingKey.from_public_point( pubkey_point, curve = SECP256k1 )
-        return '04' + public_key2.to_string().encode('hex')
+        return ec_backend().pubkey_tweak_add( chr(4) + mpk.decode('hex'), z ).encode('hex')
+
+    def get_pubkeys(self, for_change, start, count, use_mpk2=False):
+        mpk = (self.mpk2 if use_mpk2 else self.master_public_key).decode('hex')
+        tweaks = [ string_to_number( Hash( "%d:%d:"%(n,for_change) + mpk ) ) for n in range(start, start + count) ]
+        return [ pubkey.encode('hex') for pubkey in ec_backend().pubkeys_tweak_add( chr(4) + mpk, tweaks ) ]
 
     def get_private_key_from_stretched_exponent(self, sequence, secexp):
         order = generator_secp256k1.order()
@@ -477,15 +1021,17 @@ class ElectrumSequence:
         return [ self.get_private_key_from_stretched_exponent( sequence, secexp) for sequence in sequence_list]
 
     def check_seed(self, seed):
-        curve = SECP256k1
+        self.get_stretched_key(seed)
+        return True
+
+    def get_stretched_key(self, seed):
+        """ stretch the seed, and check it against the master public key """
         secexp = self.stretch_key(seed)
-        master_private_key = ecdsa.SigningKey.from_secret_exponent( secexp, curve = SECP256k1 )
-        master_public_key = master_private_key.get_verifying_key().to_string().encode('hex')
+        master_public_key = ec_backend().get_pubkey(secexp)[1:].encode('hex')
         if master_public_key != self.master_public_key:
             print_error('invalid password (mpk)')
             raise BaseException('Invalid password')
-
-        return True
+        return secexp
 
 
     def get_input_info(self, sequence):
@@ -549,19 +1095,47 @@ class BIP32Sequence:
 
 class Transaction:
     
-    def __init__(self, raw):
+    def __init__(self, raw, summary=None):
+        # raw is parsed on first access to d, inputs or outputs.
+        # if a summary (see get_summary) is passed, it is used instead of parsing raw
         self.raw = raw
-        self.deserialize()
-        self.inputs = self.d['inputs']
-        self.outputs = self.d['outputs']
-        self.outputs = map(lambda x: (x['address'],x['value']), self.outputs)
+        self.raw_bytes = None        # raw, decoded
+        self.summary = summary
         self.input_info = None
         self.is_complete = True
+
+    def __getattr__(self, name):
+        if name not in ['d', 'inputs', 'outputs']:
+            raise AttributeError(name)
+        if self.summary is not None:
+            self.d = self.d_from_summary(self.summary)
+        else:
+            self.deserialize()
+        self.inputs = self.d['inputs']
+        self.outputs = map(lambda x: (x['address'],x['value']), self.d['outputs'])
+        return self.__dict__[name]
+
+    def get_summary(self):
+        """inputs and outputs, without scripts and signatures. stored in the wallet file"""
+        if self.summary is None:
+            inputs = [ (x['prevout_hash'], x['prevout_n'], x.get('address')) for x in self.inputs ]
+            outputs = [ (x['address'], x['value'], x['raw_output_script']) for x in self.d['outputs'] ]
+            self.summary = (inputs, outputs)
+        return self.summary
+
+    @classmethod
+    def d_from_summary(klass, summary):
+        inputs, outputs = summary
+        d = {}
+        d['inputs'] = [ {'prevout_hash':h, 'prevout_n':n, 'address':addr} for h, n, addr in inputs ]
+        d['outputs'] = [ {'address':addr, 'value':v, 'raw_output_script':script, 'index':i} for i, (addr, v, script) in enumerate(outputs) ]
+        return d
         
     @classmethod
     def from_io(klass, inputs, outputs):
-        raw = klass.serialize(inputs, outputs, for_sig = -1) # for_sig=-1 means do not sign
-        self = klass(raw)
+        raw_bytes = klass.serialize_bytes(inputs, outputs, for_sig = -1) # for_sig=-1 means do not sign
+        self = klass(raw_bytes.encode('hex'))
+        self.raw_bytes = raw_bytes
         self.is_complete = False
         self.inputs = inputs
         self.outputs = outputs
@@ -605,86 +1179,126 @@ class Transaction:
 
     @classmethod
     def serialize( klass, inputs, outputs, for_sig = None ):
+        return klass.serialize_bytes(inputs, outputs, for_sig).encode('hex')
 
-        s  = int_to_hex(1,4)                                         # version
-        s += var_int( len(inputs) )                                  # number of inputs
+    @classmethod
+    def serialize_bytes( klass, inputs, outputs, for_sig = None ):
+        s = [ struct.pack('<I', 1) ]                                 # version
+        s.append( var_int_bytes(len(inputs)) )                       # number of inputs
         for i in range(len(inputs)):
             txin = inputs[i]
-            s += txin['tx_hash'].decode('hex')[::-1].encode('hex')   # prev hash
-            s += int_to_hex(txin['index'],4)                         # prev index
+            s.append( txin['tx_hash'].decode('hex')[::-1] )          # prev hash
+            s.append( struct.pack('<I', txin['index']) )             # prev index
 
             if for_sig is None:
                 pubkeysig = txin.get('pubkeysig')
                 if pubkeysig:
                     pubkey, sig = pubkeysig[0]
                     sig = sig + chr(1)                               # hashtype
-                    script  = op_push( len(sig))
-                    script += sig.encode('hex')
-                    script += op_push( len(pubkey))
-                    script += pubkey.encode('hex')
+                    script = op_push_bytes(len(sig)) + sig + op_push_bytes(len(pubkey)) + pubkey
                 else:
                     signatures = txin['signatures']
                     pubkeys = txin['pubkeys']
-                    script = '00'                                    # op_0
+                    script = ['\x00']                                # op_0
                     for sig in signatures:
-                        sig = sig + '01'
-                        script += op_push(len(sig)/2)
-                        script += sig
+                        sig = sig.decode('hex') + chr(1)
+                        script.append( op_push_bytes(len(sig)) )
+                        script.append( sig )
 
-                    redeem_script = klass.multisig_script(pubkeys,2).get('redeemScript')
-                    script += op_push(len(redeem_script)/2)
-                    script += redeem_script
+                    redeem_script = klass.multisig_script(pubkeys,2).get('redeemScript').decode('hex')
+                    script.append( op_push_bytes(len(redeem_script)) )
+                    script.append( redeem_script )
+                    script = ''.join(script)
 
             elif for_sig==i:
                 if txin.get('redeemScript'):
-                    script = txin['redeemScript']                    # p2sh uses the inner script
+                    script = txin['redeemScript'].decode('hex')     # p2sh uses the inner script
                 else:
-                    script = txin['raw_output_script']               # scriptsig
+                    script = txin['raw_output_script'].decode('hex')  # scriptsig
             else:
                 script=''
-            s += var_int( len(script)/2 )                            # script length
-            s += script
-            s += "ffffffff"                                          # sequence
-
-        s += var_int( len(outputs) )                                 # number of outputs
-        for output in outputs:
-            addr, amount = output
-            s += int_to_hex( amount, 8)                              # amount
-            addrtype, hash_160 = bc_address_to_hash_160(addr)
-            if addrtype == 0:
-                script = '76a9'                                      # op_dup, op_hash_160
-                script += '14'                                       # push 0x14 bytes
-                script += hash_160.encode('hex')
-                script += '88ac'                                     # op_equalverify, op_checksig
-            elif addrtype == 5:
-                script = 'a9'                                        # op_hash_160
-                script += '14'                                       # push 0x14 bytes
-                script += hash_160.encode('hex')
-                script += '87'                                       # op_equal
-            else:
-                raise
-            
-            s += var_int( len(script)/2 )                           #  script length
-            s += script                                             #  script
-        s += int_to_hex(0,4)                                        #  lock time
+            s.append( var_int_bytes(len(script)) )                   # script length
+            s.append( script )
+            s.append( '\xff\xff\xff\xff' )                           # sequence
+
+        s.append( klass.serialize_outputs(outputs) )
+        s.append( struct.pack('<I', 0) )                             # lock time
         if for_sig is not None and for_sig != -1:
-            s += int_to_hex(1, 4)                                   #  hash type
-        return s
+            s.append( struct.pack('<I', 1) )                         # hash type
+        return ''.join(s)
+
+    @classmethod
+    def serialize_outputs( klass, outputs ):
+        """ the outputs, serialized as bytes """
+        s = [ var_int_bytes(len(outputs)) ]                          # number of outputs
+        for addr, amount in outputs:
+            script = address_to_script(addr)
+            s.append( struct.pack('<Q', amount) )                    # amount
+            s.append( var_int_bytes(len(script)) )                   # script length
+            s.append( script )                                       # script
+        return ''.join(s)
 
 
     def for_sig(self,i):
         return self.serialize(self.inputs, self.outputs, for_sig = i)
 
 
-    def hash(self):
-        return Hash(self.raw.decode('hex') )[::-1].encode('hex')
+    def get_raw_bytes(self):
+        if self.raw_bytes is None:
+            self.raw_bytes = self.raw.decode('hex')
+        return self.raw_bytes
 
-    def sign(self, private_keys):
+    def hash(self):
+        return Hash(self.get_raw_bytes())[::-1].encode('hex')
+
+    def sighash_parts(self):
+        """
+        The parts of the SIGHASH_ALL preimages that do not depend on the
+        signed input: the header, every input with an empty script, and
+        the outputs with lock time and hash type. They are computed once,
+        instead of serializing the whole transaction for each input.
+        """
+        header = struct.pack('<I', 1) + var_int_bytes(len(self.inputs))
+        empty_inputs = ''.join( txin['tx_hash'].decode('hex')[::-1] + struct.pack('<I', txin['index']) + '\x00' + '\xff\xff\xff\xff' for txin in self.inputs )
+        tail = self.serialize_outputs(self.outputs) + struct.pack('<I', 0) + struct.pack('<I', 1)
+        return header, empty_inputs, tail
+
+    def sighash(self, i, parts):
+        """ the hash signed by input i. same as Hash(self.for_sig(i)), with parts from sighash_parts """
+        header, empty_inputs, tail = parts
+        txin = self.inputs[i]
+        script = (txin.get('redeemScript') or txin['raw_output_script']).decode('hex')
+        h = hashlib.sha256(header)
+        h.update(empty_inputs[:41*i + 36])
+        h.update(var_int_bytes(len(script)))
+        h.update(script)
+        h.update('\xff\xff\xff\xff')
+        h.update(empty_inputs[41*(i+1):])
+        h.update(tail)
+        return hashlib.sha256(h.digest()).digest()
+
+    def sign(self, private_keys, verify=True, processes=0):
+        """
+        Sign the inputs we have keys for. If verify is set, each new
+        signature is checked. With processes > 1, the signatures of a
+        large transaction are computed in a process pool.
+        """
         import deserialize
 
+        keys = {}
+        def get_key(sec):
+            # EC_KEY computes the public key; do it once per key
+            if sec not in keys:
+                pkey = regenerate_key(sec)
+                keys[sec] = pkey, GetPubKey(pkey.pubkey, is_compressed(sec))
+            return keys[sec]
+
+        keypairs = None
+        parts = self.sighash_parts()
+        jobs = []      # (input index, digest, private key)
         for i in range(len(self.inputs)):
             txin = self.inputs[i]
-            tx_for_sig = self.serialize( self.inputs, self.outputs, for_sig = i )
+            digest = self.sighash(i, parts)
 
             if txin.get('redeemScript'):
                 # 1 parse the redeem script
@@ -692,67 +1306,64 @@ class Transaction:
                 self.inputs[i]["pubkeys"] = redeem_pubkeys
 
                 # build list of public/private keys
-                keypairs = {}
-                for sec in private_keys.values():
-                    compressed = is_compressed(sec)
-                    pkey = regenerate_key(sec)
-                    pubkey = GetPubKey(pkey.pubkey, compressed)
-                    keypairs[ pubkey.encode('hex') ] = sec
+                if keypairs is None:
+                    keypairs = {}
+                    for sec in private_keys.values():
+                        keypairs[ get_key(sec)[1].encode('hex') ] = sec
 
                 # list of already existing signatures
                 signatures = txin.get("signatures",[])
-                print_error("signatures",signatures)
+                self.inputs[i]["signatures"] = signatures
 
                 for pubkey in redeem_pubkeys:
-                    public_key = ecdsa.VerifyingKey.from_string(pubkey[2:].decode('hex'), curve = SECP256k1)
                     for s in signatures:
-                        try:
-                            public_key.verify_digest( s.decode('hex')[:-1], Hash( tx_for_sig.decode('hex') ), sigdecode = ecdsa.util.sigdecode_der)
+                        if verify_der( digest, s.decode('hex')[:-1], pubkey.decode('hex') ):
                             break
-                        except ecdsa.keys.BadSignatureError:
-                            continue
                     else:
                         # check if we have a key corresponding to the redeem script
-                        if pubkey in keypairs.keys():
-                            # add signature
-                            sec = keypairs[pubkey]
-                            compressed = is_compressed(sec)
-                            pkey = regenerate_key(sec)
-                            secexp = pkey.secret
-                            private_key = ecdsa.SigningKey.from_secret_exponent( secexp, curve = SECP256k1 )
-                            public_key = private_key.get_verifying_key()
-                            sig = private_key.sign_digest( Hash( tx_for_sig.decode('hex') ), sigencode = ecdsa.util.sigencode_der )
-                            assert public_key.verify_digest( sig, Hash( tx_for_sig.decode('hex') ), sigdecode = ecdsa.util.sigdecode_der)
-                            signatures.append( sig.encode('hex') )
-                        
-                # for p2sh, pubkeysig is a tuple (may be incomplete)
-                self.inputs[i]["signatures"] = signatures
-                print_error("signatures",signatures)
-                self.is_complete = len(signatures) == num
+                        if pubkey in keypairs:
+                            jobs.append( (i, digest, keypairs[pubkey]) )
 
             else:
-                sec = private_keys[txin['address']]
-                compressed = is_compressed(sec)
-                pkey = regenerate_key(sec)
-                secexp = pkey.secret
+                jobs.append( (i, digest, private_keys[txin['address']]) )
+
+        # 2 sign
+        items = []
+        for i, digest, sec in jobs:
+            pkey, pubkey = get_key(sec)
+            items.append( (digest, pkey.secret, pkey.pubkey.ser if verify else None) )
+        if processes > 1 and len(items) > processes:
+            import multiprocessing
+            pool = multiprocessing.Pool(processes)
+            try:
+                sigs = pool.map(sign_digest, items, chunksize = max(1, len(items)/(4*processes)))
+            finally:
+                pool.close()
+        else:
+            sigs = map(sign_digest, items)
 
-                private_key = ecdsa.SigningKey.from_secret_exponent( secexp, curve = SECP256k1 )
-                public_key = private_key.get_verifying_key()
-                pkey = EC_KEY(secexp)
-                pubkey = GetPubKey(pkey.pubkey, compressed)
-                sig = private_key.sign_digest( Hash( tx_for_sig.decode('hex') ), sigencode = ecdsa.util.sigencode_der )
-                assert public_key.verify_digest( sig, Hash( tx_for_sig.decode('hex') ), sigdecode = ecdsa.util.sigdecode_der)
+        for (i, digest, sec), sig in zip(jobs, sigs):
+            txin = self.inputs[i]
+            if txin.get('redeemScript'):
+                # for p2sh, pubkeysig is a tuple (may be incomplete)
+                txin["signatures"].append( sig.encode('hex') )
+            else:
+                txin["pubkeysig"] = [(get_key(sec)[1], sig)]
 
-                self.inputs[i]["pubkeysig"] = [(pubkey, sig)]
-                self.is_complete = True
+        self.is_complete = True
+        for txin in self.inputs:
+            if txin.get('redeemScript'):
+                if len(txin["signatures"]) < deserialize.parse_redeemScript(txin['redeemScript'])[0]:
+                    self.is_complete = False
 
-        self.raw = self.serialize( self.inputs, self.outputs )
+        self.raw_bytes = self.serialize_bytes( self.inputs, self.outputs )
+        self.raw = self.raw_bytes.encode('hex')
+        self.summary = None
 
 
     def deserialize(self):
         import deserialize
-        vds = deserialize.BCDataStream()
-        vds.write(self.raw.decode('hex'))
+        vds = deserialize.BCDataStream(self.get_raw_bytes())
         self.d = deserialize.parse_Transaction(vds)
         return self.d
     
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+#
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2013 thomasv@gitorious
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+# Trusted checkpoints of the blockchain.
+#
+# Each entry is (height, hash): the headers of a chunk that contains a
+# checkpoint are verified by their hashes, and so are the chunks before it,
+# back to the previous checkpoint. The verifier trusts these instead of the
+# headers below the last checkpoint, so it only downloads the headers from
+# the chunk of the last checkpoint.
+#
+# An entry may also be (height, hash, target), for the last block of a
+# period (height = 2016*k - 1): the target is the one of the period that
+# starts after it, so the chunk of that checkpoint is not downloaded either.
+# scripts/checkpoints generates such a list from a blockchain_headers file
+# that was verified from genesis. The list can be replaced with the
+# 'checkpoints' config option.
+#
+# These are the checkpoints of the reference client.
+
+CHECKPOINTS = [
+    (0, "000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f"),
+    (11111, "0000000069e244f73d78e8fd29ba2fd2ed618bd6fa2ee92559f542fdb26e7c1d"),
+    (33333, "000000002dd5588a74784eaa7ab0507a18ad16a236e7b1ce69f00d7ddfb5d0a6"),
+    (74000, "0000000000573993a3c9e41ce34471c079dcf5f52a0e824a81e7f953b8661a20"),
+    (105000, "00000000000291ce28027faea320c8d2b054b2e0fe44a773f3eefb151d6bdc97"),
+    (134444, "00000000000005b12ffd4cd315cd34ffd4a594f430ac814c91184a0d42d2b0fe"),
+    (168000, "000000000000099e61ea72015e79632f216fe6cb33d7899acb35b75c8303b763"),
+    (193000, "000000000000059f452a5f7340de6682a977387c17010ff6e6c3bd83ca8b1317"),
+    (210000, "000000000000048b95347e83192f69cf0366076336c639f9b7228e9ba171342e"),
+    (216116, "00000000000001b4f4b433e81ee46494af945cf96014816a4e2370f11b23df4e"),
+    (225430, "00000000000001c108384350f74090433e7fcf79a606b8e797f065b130575932"),
+    (250000, "000000000000003887df1f29024b06fc2200b55f8af8f35453d7be294df2d214"),
+    (279000, "0000000000000001ae8c72a0b0c301f67e3afca10e819efa9041e458e9bd7e40"),
+    (295000, "00000000000000004d9b4ef50f0f9d686fd69db2e03af35a100370c64632a983"),
+]
@@ -3,6 +3,7 @@
 #
 
 from bitcoin import public_key_to_bc_address, hash_160_to_bc_address, hash_encode, hash_160
+from util import LRUCache
 #import socket
 import time
 import struct
@@ -17,9 +18,26 @@ import mmap
 class SerializationError(Exception):
     """ Thrown when there's a problem deserializing or serializing """
 
+# precompiled formats
+int16 = struct.Struct('<h')
+uint16 = struct.Struct('<H')
+int32 = struct.Struct('<i')
+uint32 = struct.Struct('<I')
+int64 = struct.Struct('<q')
+uint64 = struct.Struct('<Q')
+uint8 = struct.Struct('<B')
+
 class BCDataStream(object):
-    def __init__(self):
-        self.input = None
+    """
+    The input can be a string, a bytearray, an mmap, a buffer or a
+    memoryview. Numbers are unpacked in place. read_string_offsets
+    skips a string and returns its offsets, and get_buffer returns a
+    view of a part of the input, so that scripts can be parsed without
+    being copied.
+    """
+
+    def __init__(self, input=None):
+        self.input = input
         self.read_cursor = 0
 
     def clear(self):
@@ -30,6 +48,9 @@ class BCDataStream(object):
         if self.input is None:
             self.input = bytes
         else:
+            # append in place, instead of copying the whole input
+            if type(self.input) != bytearray:
+                self.input = bytearray(self.input)
             self.input += bytes
 
     def map_file(self, file, start):  # Initialize with bytes from file
@@ -50,15 +71,33 @@ class BCDataStream(object):
         # ... and the Bitcoin client is coded to understand:
         # greater than 4,294,967,295 : byte '255' 8-byte-length followed by bytes of string
         # ... but I don't think it actually handles any strings that big.
+        start, end = self.read_string_offsets()
+        return self.get_bytes(start, end)
+
+    def read_string_offsets(self):
+        """ skip a string, and return its start and end offsets in the input """
         if self.input is None:
             raise SerializationError("call write(bytes) before trying to deserialize")
 
-        try:
-            length = self.read_compact_size()
-        except IndexError:
+        length = self.read_compact_size()
+        start = self.read_cursor
+        if start + length > len(self.input):
             raise SerializationError("attempt to read past end of buffer")
-
-        return self.read_bytes(length)
+        self.read_cursor += length
+        return start, start + length
+
+    def get_bytes(self, start, end):
+        result = self.input[start:end]
+        if type(result) == memoryview:
+            return result.tobytes()
+        return str(result)
+
+    def get_buffer(self, start, end):
+        """ a read-only view of input[start:end], without copy """
+        if type(self.input) == memoryview:
+            # scripts are sliced and hashed, which a memoryview does not support
+            return self.input[start:end].tobytes()
+        return buffer(self.input, start, end - start)
 
     def write_string(self, string):
         # Length-encoded as with read-string
@@ -66,22 +105,17 @@ class BCDataStream(object):
         self.write(string)
 
     def read_bytes(self, length):
-        try:
-            result = self.input[self.read_cursor:self.read_cursor+length]
-            self.read_cursor += length
-            return result
-        except IndexError:
-            raise SerializationError("attempt to read past end of buffer")
-
-        return ''
+        result = self.get_bytes(self.read_cursor, self.read_cursor + length)
+        self.read_cursor += length
+        return result
 
     def read_boolean(self): return self.read_bytes(1)[0] != chr(0)
-    def read_int16(self): return self._read_num('<h')
-    def read_uint16(self): return self._read_num('<H')
-    def read_int32(self): return self._read_num('<i')
-    def read_uint32(self): return self._read_num('<I')
-    def read_int64(self): return self._read_num('<q')
-    def read_uint64(self): return self._read_num('<Q')
+    def read_int16(self): return self._read_struct(int16)
+    def read_uint16(self): return self._read_struct(uint16)
+    def read_int32(self): return self._read_struct(int32)
+    def read_uint32(self): return self._read_struct(uint32)
+    def read_int64(self): return self._read_struct(int64)
+    def read_uint64(self): return self._read_struct(uint64)
 
     def write_boolean(self, val): return self.write(chr(1) if val else chr(0))
     def write_int16(self, val): return self._write_num('<h', val)
@@ -92,14 +126,13 @@ class BCDataStream(object):
     def write_uint64(self, val): return self._write_num('<Q', val)
 
     def read_compact_size(self):
-        size = ord(self.input[self.read_cursor])
-        self.read_cursor += 1
+        size = self._read_struct(uint8)
         if size == 253:
-            size = self._read_num('<H')
+            size = self._read_struct(uint16)
         elif size == 254:
-            size = self._read_num('<I')
+            size = self._read_struct(uint32)
         elif size == 255:
-            size = self._read_num('<Q')
+            size = self._read_struct(uint64)
         return size
 
     def write_compact_size(self, size):
@@ -117,11 +150,17 @@ class BCDataStream(object):
             self.write('\xff')
             self._write_num('<Q', size)
 
-    def _read_num(self, format):
-        (i,) = struct.unpack_from(format, self.input, self.read_cursor)
-        self.read_cursor += struct.calcsize(format)
+    def _read_struct(self, s):
+        try:
+            (i,) = s.unpack_from(self.input, self.read_cursor)
+        except struct.error:
+            raise SerializationError("attempt to read past end of buffer")
+        self.read_cursor += s.size
         return i
 
+    def _read_num(self, format):
+        return self._read_struct(struct.Struct(format))
+
     def _write_num(self, format, num):
         s = struct.pack(format, num)
         self.write(s)
@@ -161,6 +200,8 @@ class Enumeration:
             i = i + 1
         self.lookup = lookup
         self.reverseLookup = reverseLookup
+        # plain attributes, so that opcodes.OP_X does not call __getattr__
+        self.__dict__.update(lookup)
     def __getattr__(self, attr):
         if not self.lookup.has_key(attr):
             raise AttributeError
@@ -186,11 +227,11 @@ def parse_TxIn(vds):
     d = {}
     d['prevout_hash'] = hash_encode(vds.read_bytes(32))
     d['prevout_n'] = vds.read_uint32()
-    scriptSig = vds.read_bytes(vds.read_compact_size())
+    start, end = vds.read_string_offsets()
     d['sequence'] = vds.read_uint32()
 
-    if scriptSig:
-        pubkeys, signatures, address = get_address_from_input_script(scriptSig)
+    if end > start:
+        pubkeys, signatures, address = get_address_from_input_script(vds.get_buffer(start, end))
     else:
         pubkeys = []
         signatures = []
@@ -205,7 +246,9 @@ def parse_TxIn(vds):
 def parse_TxOut(vds, i):
     d = {}
     d['value'] = vds.read_int64()
-    scriptPubKey = vds.read_bytes(vds.read_compact_size())
+    start, end = vds.read_string_offsets()
+    # one copy of the script, for the address cache key and for the hex
+    scriptPubKey = vds.get_bytes(start, end)
     d['address'] = get_address_from_output_script(scriptPubKey)
     d['raw_output_script'] = scriptPubKey.encode('hex')
     d['index'] = i
@@ -228,6 +271,10 @@ def parse_Transaction(vds):
     return d
 
 def parse_redeemScript(bytes):
+    pubkeys = get_multisig_pubkeys(bytes.decode('hex'))
+    if pubkeys:
+        return 2, [ x.encode('hex') for x in pubkeys ]
+
     dec = [ x for x in script_GetOp(bytes.decode('hex')) ]
 
     # 2 of 2
@@ -321,7 +368,75 @@ def match_decoded(decoded, to_match):
             return False
     return True
 
+# Standard scripts are recognized by their length and bytes, before
+# falling back to the generic decoders, which tokenize the script with
+# script_GetOp. Both give the same results.
+
+output_scripts = LRUCache(10000)
+
+def get_address_from_output_script(bytes):
+    bytes = str(bytes)
+    address = output_scripts.get(bytes)
+    if address is None:
+        address = classify_output_script(bytes) or decode_output_script(bytes)
+        output_scripts.put(bytes, address)
+    return address
+
+
+def classify_output_script(bytes):
+    """ the address of a pay-to-pubkey-hash, p2sh or pay-to-pubkey script, or None """
+    n = len(bytes)
+    # DUP HASH160 20 BYTES:... EQUALVERIFY CHECKSIG
+    if n == 25 and bytes[0:3] == '\x76\xa9\x14' and bytes[23:25] == '\x88\xac':
+        return hash_160_to_bc_address(bytes[3:23])
+    # HASH160 20 BYTES:... EQUAL
+    if n == 23 and bytes[0:2] == '\xa9\x14' and bytes[22] == '\x87':
+        return hash_160_to_bc_address(bytes[2:22], 5)
+    # n BYTES:... CHECKSIG
+    if n > 2 and ord(bytes[0]) == n - 2 < opcodes.OP_PUSHDATA1 and bytes[-1] == '\xac':
+        return public_key_to_bc_address(bytes[1:-1])
+
+
 def get_address_from_input_script(bytes):
+    result = classify_input_script(bytes)
+    if result is None:
+        result = decode_input_script(bytes)
+    return result
+
+
+def classify_input_script(bytes):
+    """ (None, None, address) for a script that pushes a signature and a public key, or None """
+    n = len(bytes)
+    if n < 4:
+        return
+    i = ord(bytes[0]) + 1
+    if not 1 < i <= opcodes.OP_PUSHDATA1 or i >= n:
+        return
+    j = ord(bytes[i]) + 1
+    if not 1 < j <= opcodes.OP_PUSHDATA1 or i + j != n:
+        return
+    return None, None, public_key_to_bc_address(bytes[i+1:n])
+
+
+def get_multisig_pubkeys(bytes):
+    """ the public keys of a 2 of 2 or 2 of 3 multisig script, or None """
+    n = len(bytes)
+    if n < 3 or bytes[0] != chr(opcodes.OP_2) or bytes[-1] != chr(opcodes.OP_CHECKMULTISIG):
+        return
+    pubkeys = []
+    i = 1
+    while i < n - 2:
+        size = ord(bytes[i])
+        if not 0 < size < opcodes.OP_PUSHDATA1:
+            return
+        pubkeys.append(bytes[i+1:i+1+size])
+        i += 1 + size
+    if i != n - 2 or len(pubkeys) not in [2, 3] or bytes[i] != chr(opcodes.OP_1 - 1 + len(pubkeys)):
+        return
+    return pubkeys
+
+
+def decode_input_script(bytes):
     decoded = [ x for x in script_GetOp(bytes) ]
 
     # non-generated TxIn transactions push a signature
@@ -342,6 +457,10 @@ def get_address_from_input_script(bytes):
         num = len(match) - 2
         signatures = map(lambda x:x[1].encode('hex'), decoded[1:-1])
         
+        pubkeys = get_multisig_pubkeys(redeemScript)
+        if pubkeys:
+            return [ x.encode('hex') for x in pubkeys ], signatures, hash_160_to_bc_address(hash_160(redeemScript), 5)
+
         dec2 = [ x for x in script_GetOp(redeemScript) ]
 
         # 2 of 2
@@ -360,7 +479,7 @@ def get_address_from_input_script(bytes):
 
 
 
-def get_address_from_output_script(bytes):
+def decode_output_script(bytes):
     decoded = [ x for x in script_GetOp(bytes) ]
 
     # The Genesis Block, self-payments, and pay-by-IP-address payments look like:
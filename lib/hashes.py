@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+#
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2013 thomasv@gitorious
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+# RIPEMD-160 providers.
+#
+# hashlib only has RIPEMD-160 if its OpenSSL provides it through EVP,
+# which OpenSSL 3 does not without the legacy provider. The first
+# provider of ripemd160_order that is available is chosen once, at
+# import time; the pure Python one is always available.
+
+import hashlib, struct
+from util import load_library
+
+
+def hashlib_ripemd160():
+    hashlib.new('ripemd160')
+    return lambda data: hashlib.new('ripemd160', data).digest()
+
+
+def openssl_ripemd160():
+    import ctypes
+    lib = load_library('crypto', ['libcrypto.so.3', 'libcrypto.so.1.1', 'libcrypto.so.1.0.0', 'libcrypto.dylib', 'libeay32.dll'])
+    f = lib.RIPEMD160
+    f.argtypes = [ctypes.c_char_p, ctypes.c_size_t, ctypes.c_char_p]
+    def ripemd160(data):
+        md = ctypes.create_string_buffer(20)
+        f(data, len(data), md)
+        return md.raw
+    return ripemd160
+
+
+def pycryptodome_ripemd160():
+    from Crypto.Hash import RIPEMD160
+    return lambda data: RIPEMD160.new(data).digest()
+
+
+def python_ripemd160():
+    return ripemd160_python
+
+
+ripemd160_providers = {
+    'hashlib': hashlib_ripemd160,
+    'openssl': openssl_ripemd160,
+    'pycryptodome': pycryptodome_ripemd160,
+    'python': python_ripemd160,
+}
+
+ripemd160_order = ['hashlib', 'openssl', 'pycryptodome', 'python']
+
+
+def get_ripemd160(name=None):
+    """ return (name, function) for the given provider, or the first available one """
+    for name in ([name] if name else ripemd160_order):
+        try:
+            f = ripemd160_providers[name]()
+            if f('abc') == '8eb208f7e05d987a9b044a8e98c6b087f15a0bfc'.decode('hex'):
+                return name, f
+        except BaseException:
+            continue
+    raise BaseException("ripemd160 not available")
+
+
+
+# Pure Python RIPEMD-160. The left and the right lines of the compression
+# function do not depend on each other, so each of them runs as 5 loops of
+# 16 steps, one per round, with the boolean function inlined.
+
+_M = 0xffffffff
+
+_RL = [ 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
+        7, 4, 13, 1, 10, 6, 15, 3, 12, 0, 9, 5, 2, 14, 11, 8,
+        3, 10, 14, 4, 9, 15, 8, 1, 2, 7, 0, 6, 13, 11, 5, 12,
+        1, 9, 11, 10, 0, 8, 12, 4, 13, 3, 7, 15, 14, 5, 6, 2,
+        4, 0, 5, 9, 7, 12, 2, 10, 14, 1, 3, 8, 11, 6, 15, 13 ]
+
+_RR = [ 5, 14, 7, 0, 9, 2, 11, 4, 13, 6, 15, 8, 1, 10, 3, 12,
+        6, 11, 3, 7, 0, 13, 5, 10, 14, 15, 8, 12, 4, 9, 1, 2,
+        15, 5, 1, 3, 7, 14, 6, 9, 11, 8, 12, 2, 10, 0, 4, 13,
+        8, 6, 4, 1, 3, 11, 15, 0, 5, 12, 2, 13, 9, 7, 10, 14,
+        12, 15, 10, 4, 1, 5, 8, 7, 6, 2, 13, 14, 0, 3, 9, 11 ]
+
+_SL = [ 11, 14, 15, 12, 5, 8, 7, 9, 11, 13, 14, 15, 6, 7, 9, 8,
+        7, 6, 8, 13, 11, 9, 7, 15, 7, 12, 15, 9, 11, 7, 13, 12,
+        11, 13, 6, 7, 14, 9, 13, 15, 14, 8, 13, 6, 5, 12, 7, 5,
+        11, 12, 14, 15, 14, 15, 9, 8, 9, 14, 5, 6, 8, 6, 5, 12,
+        9, 15, 5, 11, 6, 8, 13, 12, 5, 12, 13, 14, 11, 8, 5, 6 ]
+
+_SR = [ 8, 9, 9, 11, 13, 15, 15, 5, 7, 7, 8, 11, 14, 14, 12, 6,
+        9, 13, 15, 7, 12, 8, 9, 11, 7, 7, 12, 7, 6, 15, 13, 11,
+        9, 7, 15, 11, 8, 6, 6, 14, 12, 13, 5, 14, 13, 13, 7, 5,
+        15, 5, 8, 11, 14, 14, 6, 14, 6, 9, 12, 9, 12, 5, 15, 8,
+        8, 5, 12, 9, 12, 5, 14, 6, 8, 13, 6, 5, 15, 13, 11, 11 ]
+
+# (word index, shift) of the 16 steps of each round
+_L = [ zip(_RL[16*j:16*j+16], _SL[16*j:16*j+16]) for j in range(5) ]
+_R = [ zip(_RR[16*j:16*j+16], _SR[16*j:16*j+16]) for j in range(5) ]
+
+_block = struct.Struct('<16I')
+
+
+def _compress(h, X):
+    h0, h1, h2, h3, h4 = h
+
+    # left line
+    a, b, c, d, e = h
+    for i, s in _L[0]:
+        t = (a + (b ^ c ^ d) + X[i]) & _M
+        a, e, d, c, b = e, d, ((c << 10) | (c >> 22)) & _M, b, (((t << s) | (t >> (32 - s))) + e) & _M
+    for i, s in _L[1]:
+        t = (a + ((b & c) | (~b & d)) + X[i] + 0x5a827999) & _M
+        a, e, d, c, b = e, d, ((c << 10) | (c >> 22)) & _M, b, (((t << s) | (t >> (32 - s))) + e) & _M
+    for i, s in _L[2]:
+        t = (a + ((b | ~c) ^ d) + X[i] + 0x6ed9eba1) & _M
+        a, e, d, c, b = e, d, ((c << 10) | (c >> 22)) & _M, b, (((t << s) | (t >> (32 - s))) + e) & _M
+    for i, s in _L[3]:
+        t = (a + ((b & d) | (c & ~d)) + X[i] + 0x8f1bbcdc) & _M
+        a, e, d, c, b = e, d, ((c << 10) | (c >> 22)) & _M, b, (((t << s) | (t >> (32 - s))) + e) & _M
+    for i, s in _L[4]:
+        t = (a + (b ^ (c | ~d)) + X[i] + 0xa953fd4e) & _M
+        a, e, d, c, b = e, d, ((c << 10) | (c >> 22)) & _M, b, (((t << s) | (t >> (32 - s))) + e) & _M
+    al, bl, cl, dl, el = a, b, c, d, e
+
+    # right line, with the boolean functions in reverse order
+    a, b, c, d, e = h
+    for i, s in _R[0]:
+        t = (a + (b ^ (c | ~d)) + X[i] + 0x50a28be6) & _M
+        a, e, d, c, b = e, d, ((c << 10) | (c >> 22)) & _M, b, (((t << s) | (t >> (32 - s))) + e) & _M
+    for i, s in _R[1]:
+        t = (a + ((b & d) | (c & ~d)) + X[i] + 0x5c4dd124) & _M
+        a, e, d, c, b = e, d, ((c << 10) | (c >> 22)) & _M, b, (((t << s) | (t >> (32 - s))) + e) & _M
+    for i, s in _R[2]:
+        t = (a + ((b | ~c) ^ d) + X[i] + 0x6d703ef3) & _M
+        a, e, d, c, b = e, d, ((c << 10) | (c >> 22)) & _M, b, (((t << s) | (t >> (32 - s))) + e) & _M
+    for i, s in _R[3]:
+        t = (a + ((b & c) | (~b & d)) + X[i] + 0x7a6d76e9) & _M
+        a, e, d, c, b = e, d, ((c << 10) | (c >> 22)) & _M, b, (((t << s) | (t >> (32 - s))) + e) & _M
+    for i, s in _R[4]:
+        t = (a + (b ^ c ^ d) + X[i]) & _M
+        a, e, d, c, b = e, d, ((c << 10) | (c >> 22)) & _M, b, (((t << s) | (t >> (32 - s))) + e) & _M
+
+    return [ (h1 + cl + d) & _M, (h2 + dl + e) & _M, (h3 + el + a) & _M, (h4 + al + b) & _M, (h0 + bl + c) & _M ]
+
+
+def ripemd160_python(data):
+    n = len(data)
+    data = data + '\x80' + '\x00' * ((55 - n) % 64) + struct.pack('<Q', 8 * n)
+    h = [ 0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476, 0xc3d2e1f0 ]
+    for i in xrange(0, len(data), 64):
+        h = _compress(h, _block.unpack_from(data, i))
+    return struct.pack('<5I', *h)
+
+
+ripemd160_provider, ripemd160 = get_ripemd160()
@@ -22,9 +22,15 @@ import threading, traceback, sys, time, json, Queue
 
 from version import ELECTRUM_VERSION, PROTOCOL_VERSION
 from util import print_error, print_msg
+from transport import Future, Connection, HTTPConnectionPool, get_event_loop
 
 
 DEFAULT_TIMEOUT = 5
+POLL_TIMEOUT = 30     # a poll may be held by the server until it has notifications
+POLL_MIN = 1
+POLL_MAX = 15
+RECONNECT_MIN = 1
+RECONNECT_MAX = 60
 DEFAULT_SERVERS = [ 
     #'electrum.bitcoins.sk:50001:t',
     #'uncle-enzo.info:50001:t',
@@ -72,11 +78,12 @@ class Interface(threading.Thread):
         self.port = port
         self.proxy = proxy
         self.use_ssl = use_ssl
-        self.poll_interval = 1
+        self.poll_interval = POLL_MIN
 
         #json
         self.message_id = 0
-        self.unanswered_requests = {}
+        self.unanswered_requests = {}   # id -> method, params, channels waiting for the response
+        self.inflight = {}              # (method, params as json) -> id of the unanswered request
 
 
 
@@ -87,20 +94,30 @@ class Interface(threading.Thread):
 
         msg_id = c.get('id')
         error = c.get('error')
+
+        if msg_id is not None:
+            with self.lock:
+                known = msg_id in self.unanswered_requests
+            if not known:
+                # e.g. the ping of a standby connection
+                print_error("response to unknown request", msg_id)
+                return
+            self.update_rtime(msg_id)
         
         if error:
             print_error("received error:", c)
             if msg_id is not None:
-                with self.lock: 
-                    method, params, channel = self.unanswered_requests.pop(msg_id)
-                response_queue = self.responses[channel]
-                response_queue.put({'method':method, 'params':params, 'error':error, 'id':msg_id})
+                method, params, channels = self.pop_request(msg_id)
+                for channel in channels:
+                    if isinstance(channel, Future):
+                        channel.set_error(error)
+                    else:
+                        self.responses[channel].put({'method':method, 'params':params, 'error':error, 'id':msg_id})
 
             return
 
         if msg_id is not None:
-            with self.lock: 
-                method, params, channel = self.unanswered_requests.pop(msg_id)
+            method, params, channels = self.pop_request(msg_id)
             result = c.get('result')
 
             if method == 'server.version':
@@ -152,16 +169,77 @@ class Interface(threading.Thread):
             with self.lock:
                 for k,v in self.subscriptions.items():
                     if (method, params) in v:
-                        channel = k
+                        channels = [k]
                         break
                 else:
                     print_error( "received unexpected notification", method, params)
                     print_error( self.subscriptions )
                     return
-                
-        response_queue = self.responses[channel]
-        response_queue.put({'method':method, 'params':params, 'result':result, 'id':msg_id})
 
+        if method[-10:] == '.subscribe' and msg_id is not None:
+            key = method, json.dumps(params)
+            with self.lock:
+                unchanged = key in self.statuses and self.statuses[key] == result
+            if unchanged:
+                # the channels already have this status, see set_status
+                return
+
+        # identical requests were coalesced: all their channels get the response
+        for channel in channels:
+            if isinstance(channel, Future):
+                channel.set_result(result)
+            else:
+                self.responses[channel].put({'method':method, 'params':params, 'result':result, 'id':msg_id})
+
+
+    def new_requests(self, messages, channel):
+        """register messages as unanswered requests, and return their ids and the requests to send.
+        a message identical to an unanswered request is not sent: it waits for the same response.
+        the caller holds self.lock"""
+        ids = []
+        requests = []
+        t = time.time()
+        for i, m in enumerate(messages):
+            method, params = m
+            c = channel[i] if type(channel) == list else channel
+            key = method, json.dumps(params)
+            msg_id = self.inflight.get(key)
+            if msg_id is not None:
+                self.unanswered_requests[msg_id][2].append(c)
+            else:
+                msg_id = self.message_id
+                self.message_id += 1
+                self.unanswered_requests[msg_id] = method, params, [c]
+                self.inflight[key] = msg_id
+                self.request_times[msg_id] = t
+                requests.append( { 'id':msg_id, 'method':method, 'params':params } )
+            ids.append(msg_id)
+        return ids, requests
+
+    def pop_request(self, msg_id):
+        with self.lock:
+            method, params, channels = self.unanswered_requests.pop(msg_id)
+            self.inflight.pop((method, json.dumps(params)), None)
+        return method, params, channels
+
+    def pop_unanswered_requests(self):
+        """remove all the unanswered requests, and return them as a list of (method, params, channels)"""
+        with self.lock:
+            requests = self.unanswered_requests.values()
+            self.unanswered_requests = {}
+            self.inflight = {}
+            self.request_times.clear()
+        return requests
+
+
+
+    def update_rtime(self, msg_id):
+        with self.lock:
+            t = self.request_times.pop(msg_id, None)
+        if t is None: return
+        rtime = time.time() - t
+        # moving average, of the tcp requests
+        self.rtime = 0.8*self.rtime + 0.2*rtime if self.rtime else rtime
 
 
     def get_response(self, channel='default', block=True, timeout=10000000000):
@@ -179,9 +257,18 @@ class Interface(threading.Thread):
         self.init_server(host, port, proxy, use_ssl)
         self.session_id = None
         self.connection_msg = ('https' if self.use_ssl else 'http') + '://%s:%d'%( self.host, self.port )
+        if self.proxy:
+            self.connection_msg += " using proxy %s:%s:%s"%(self.proxy.get('mode'), self.proxy.get('host'), self.proxy.get('port'))
+            http_proxy = proxy_modes.index(self.proxy["mode"]) + 1, self.proxy["host"], int(self.proxy["port"])
+        else:
+            http_proxy = None
+        self.http = HTTPConnectionPool(self.host, self.port, self.use_ssl, http_proxy)
+        self.poll_event = threading.Event()
+        self.attempts += 1
         try:
             self.poll()
         except:
+            self.failures += 1
             return
 
         if self.session_id:
@@ -191,10 +278,10 @@ class Interface(threading.Thread):
     def run_http(self):
         self.is_connected = True
         while self.is_connected:
+            t = time.time()
             try:
                 if self.session_id:
                     self.poll()
-                time.sleep(self.poll_interval)
             except socket.gaierror:
                 break
             except socket.error:
@@ -202,8 +289,13 @@ class Interface(threading.Thread):
             except:
                 traceback.print_exc(file=sys.stdout)
                 break
-            
+            # a poll that the server held for the whole interval is sent again at once.
+            # sending new requests wakes up the loop
+            self.poll_event.wait(max(0, self.poll_interval - (time.time() - t)))
+            self.poll_event.clear()
+
         self.is_connected = False
+        self.http.close()
 
                 
     def poll(self):
@@ -211,49 +303,47 @@ class Interface(threading.Thread):
 
 
     def send_http(self, messages, channel='default'):
-        import urllib2, json, time, cookielib
-        
-        if self.proxy:
-            import socks
-            socks.setdefaultproxy(proxy_modes.index(self.proxy["mode"]) + 1, self.proxy["host"], int(self.proxy["port"]) )
-            socks.wrapmodule(urllib2)
-
-        cj = cookielib.CookieJar()
-        opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cj))
-        urllib2.install_opener(opener)
-
-        t1 = time.time()
-
-        data = []
-        for m in messages:
-            method, params = m
-            if type(params) != type([]): params = [params]
-            data.append( { 'method':method, 'id':self.message_id, 'params':params } )
-            self.unanswered_requests[self.message_id] = method, params, channel
-            self.message_id += 1
-
-        if data:
-            data_json = json.dumps(data)
-        else:
-            # poll with GET
-            data_json = None 
+        messages = [ (method, params if type(params) == type([]) else [params]) for method, params in messages ]
+        with self.lock:
+            ids, data = self.new_requests(messages, channel)
 
-            
         headers = {'content-type': 'application/json'}
         if self.session_id:
             headers['cookie'] = 'SESSION=%s'%self.session_id
 
         try:
-            req = urllib2.Request(self.connection_msg, data_json, headers)
-            response_stream = urllib2.urlopen(req, timeout=DEFAULT_TIMEOUT)
-        except:
-            return
-
-        for index, cookie in enumerate(cj):
-            if cookie.name=='SESSION':
-                self.session_id = cookie.value
+            if data:
+                r, response = self.http.request('POST', '/', json.dumps(data), headers, DEFAULT_TIMEOUT)
+            else:
+                # poll with GET
+                r, response = self.http.request('GET', '/', None, headers, POLL_TIMEOUT)
+            if r.status != 200:
+                raise BaseException("http error %d"%r.status)
+        except BaseException, e:
+            # these requests will not be answered: fail their futures
+            futures = []
+            with self.lock:
+                for item in data:
+                    method, params, channels = self.unanswered_requests.pop(item['id'])
+                    self.inflight.pop((method, json.dumps(params)), None)
+                    self.request_times.pop(item['id'], None)
+                    futures += [ c for c in channels if isinstance(c, Future) ]
+            for future in futures:
+                future.set_error(str(e))
+            if data:
+                # sent by another thread: stop the polling loop, we reconnect
+                self.is_connected = False
+                self.poll_event.set()
+                return ids
+            # a poll, from init_http or run_http
+            if isinstance(e, socket.error):
+                raise
+            raise socket.error(str(e))
+
+        m = re.search('SESSION=([^;,\s]+)', r.getheader('set-cookie') or '')
+        if m:
+            self.session_id = m.group(1)
 
-        response = response_stream.read()
         self.bytes_received += len(response)
         if response: 
             response = json.loads( response )
@@ -263,15 +353,18 @@ class Interface(threading.Thread):
                 for item in response:
                     self.queue_json_response(item)
 
-        if response: 
-            self.poll_interval = 1
-        else:
-            if self.poll_interval < 15: 
-                self.poll_interval += 1
-        #print self.poll_interval, response
+        # poll often while we wait for responses or notifications, and back off when the server is quiet
+        if response or self.unanswered_requests:
+            self.poll_interval = POLL_MIN
+        elif not data:
+            self.poll_interval = min(2*self.poll_interval, POLL_MAX) if self.subscriptions else POLL_MAX
+        if data:
+            # notifications usually follow requests: wake up the polling loop
+            self.poll_interval = POLL_MIN
+            self.poll_event.set()
 
-        self.rtime = time.time() - t1
         self.is_connected = True
+        return ids
 
 
 
@@ -279,97 +372,192 @@ class Interface(threading.Thread):
     def init_tcp(self, host, port, proxy=None, use_ssl=True):
         self.init_server(host, port, proxy, use_ssl)
 
-        global proxy_modes
         self.connection_msg = "%s:%d"%(self.host,self.port)
-        if self.proxy is None:
+        if self.proxy is not None:
+            self.connection_msg += " using proxy %s:%s:%s"%(self.proxy.get('mode'), self.proxy.get('host'), self.proxy.get('port'))
+
+        self.attempts += 1
+        s = self.new_socket(self.host, self.port, self.proxy, self.use_ssl)
+        if s is None:
+            self.failures += 1
+            self.is_connected = False
+            self.connection = None
+            return
+
+        # from now on, the socket is run by the event loop
+        self.closed_event = threading.Event()
+        self.connection = Connection(get_event_loop(), s, self.queue_json_response, self.on_close, self.on_data)
+        self.is_connected = True
+        self.connection.loop.call_later(60, self.check_idle, self.connection)
+
+
+    def new_socket(self, host, port, proxy, use_ssl):
+        """return a socket connected to the server, or None"""
+        global proxy_modes
+        if proxy is None:
             s = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
         else:
-            self.connection_msg += " using proxy %s:%s:%s"%(self.proxy.get('mode'), self.proxy.get('host'), self.proxy.get('port'))
             import socks
             s = socks.socksocket()
-            s.setproxy(proxy_modes.index(self.proxy["mode"]) + 1, self.proxy["host"], int(self.proxy["port"]) )
+            s.setproxy(proxy_modes.index(proxy["mode"]) + 1, proxy["host"], int(proxy["port"]) )
 
-        if self.use_ssl:
-            s = ssl.wrap_socket(s, ssl_version=ssl.PROTOCOL_SSLv23)
-            
         s.settimeout(2)
         s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
 
         try:
-            s.connect(( self.host.encode('ascii'), int(self.port)))
-            s.settimeout(60)
-            self.s = s
-            self.is_connected = True
+            s.connect(( host.encode('ascii'), int(port)))
+            if use_ssl:
+                # wrap the connected socket: wrapping a socksocket before connecting it would bypass the proxy
+                s = ssl.wrap_socket(s, ssl_version=ssl.PROTOCOL_SSLv23)
         except:
-            self.is_connected = False
-            self.s = None
+            return None
+        return s
 
+    def on_data(self, n):
+        self.bytes_received += n
 
-    def run_tcp(self):
-        try:
-            out = ''
-            while self.is_connected:
-
-                try: 
-                    timeout = False
-                    msg = self.s.recv(1024)
-                except socket.timeout:
-                    timeout = True
-                except ssl.SSLError:
-                    timeout = True
-
-                if timeout:
-                    # ping the server with server.version, as a real ping does not exist yet
-                    self.send([('server.version', [ELECTRUM_VERSION, PROTOCOL_VERSION])])
-                    continue
-
-                out += msg
-                self.bytes_received += len(msg)
-                if msg == '': 
-                    self.is_connected = False
-
-                while True:
-                    s = out.find('\n')
-                    if s==-1: break
-                    c = out[0:s]
-                    out = out[s+1:]
-                    c = json.loads(c)
-                    self.queue_json_response(c)
+    def on_close(self):
+        self.is_connected = False
+        if not self.stopping:
+            self.failures += 1
+        with self.lock:
+            self.request_times.clear()
+            # the requests sent on this connection will not be answered
+            self.inflight = {}
+        self.closed_event.set()
+
+    def fail_requests(self, error):
+        """fail the unanswered requests that wait for a future"""
+        futures = []
+        with self.lock:
+            for msg_id, (method, params, channels) in self.unanswered_requests.items():
+                futures += [ c for c in channels if isinstance(c, Future) ]
+                channels[:] = [ c for c in channels if not isinstance(c, Future) ]
+                if not channels:
+                    self.unanswered_requests.pop(msg_id)
+                    self.inflight.pop((method, json.dumps(params)), None)
+        for future in futures:
+            future.set_error(error)
+
+    def check_idle(self, connection):
+        if connection.closed:
+            return
+        idle = time.time() - connection.last_received
+        if idle >= 60:
+            # ping the server with server.version, as a real ping does not exist yet.
+            # the response goes to a Future that nobody reads, not to a channel
+            self.send_request('server.version', [ELECTRUM_VERSION, PROTOCOL_VERSION])
+            idle = 0
+        connection.loop.call_later(60 - idle, self.check_idle, connection)
+
+
+    def start_standby(self):
+        """connect to a standby server in the background, to fail over to it when we are disconnected.
+        only if a standby_server is configured, and the server is not imposed"""
+        if self.fixed_server or self.standby or self.stopping:
+            return
+        if not self.config.get('standby_server'):
+            return
+        t = threading.Thread(target=self.connect_standby)
+        t.daemon = True
+        t.start()
+
+    def connect_standby(self):
+        server = self.config.get('standby_server')
+        host, port, protocol = server.split(':')
+        if server == self.server or protocol not in 'st':
+            return
+        proxy = self.parse_proxy_options(self.config.get('proxy'))
+        s = self.new_socket(host, port, proxy, protocol == 's')
+        if s is None:
+            return
+        connection = Connection(get_event_loop(), s, lambda message: None, lambda: self.on_standby_close(connection))
+        connection.send_json([{'id':'standby', 'method':'server.version', 'params':[ELECTRUM_VERSION, PROTOCOL_VERSION]}])
+        with self.lock:
+            if self.standby is None and not self.stopping:
+                self.standby = server, connection
+        if self.standby and self.standby[1] is connection:
+            print_error("standby server:", server)
+            connection.loop.call_later(60, self.ping_standby, connection)
+        else:
+            connection.close()
+
+    def ping_standby(self, connection):
+        with self.lock:
+            standby = self.standby
+        if connection.closed or not standby or standby[1] is not connection:
+            # closed, dropped, or we failed over to it and check_idle pings it
+            return
+        idle = time.time() - connection.last_received
+        if idle >= 60:
+            connection.send_json([{'id':'standby', 'method':'server.version', 'params':[ELECTRUM_VERSION, PROTOCOL_VERSION]}])
+            idle = 0
+        connection.loop.call_later(60 - idle, self.ping_standby, connection)
+
+    def on_standby_close(self, connection):
+        with self.lock:
+            if self.standby and self.standby[1] is connection:
+                self.standby = None
+        if self.connection is connection:
+            self.on_close()
+
+    def drop_standby(self):
+        with self.lock:
+            standby, self.standby = self.standby, None
+        if standby:
+            standby[1].close()
+
+    def failover(self):
+        """switch to the standby server. return False if it is not connected"""
+        with self.lock:
+            standby, self.standby = self.standby, None
+        if standby is None:
+            return False
+        server, connection = standby
+        host, port, protocol = server.split(':')
+        self.protocol = protocol
+        self.server = server
+        self.init_server(host, int(port), self.parse_proxy_options(self.config.get('proxy')), protocol == 's')
+        self.connection_msg = "%s:%d"%(self.host,self.port)
+        self.attempts += 1
+        self.closed_event = threading.Event()
+        self.connection = connection
+        self.is_connected = True
+        connection.on_data = self.on_data
+        connection.on_message = self.queue_json_response
+        connection.on_close = self.on_close
+        if connection.closed:
+            self.is_connected = False
+            self.connection = None
+            return False
+        print_error("failover to", server)
+        self.config.set_key('server', server, False)
+        connection.loop.call_later(60, self.check_idle, connection)
+        return True
 
-        except:
-            traceback.print_exc(file=sys.stdout)
 
+    def run_tcp(self):
+        self.closed_event.wait()
         self.is_connected = False
 
 
     def send_tcp(self, messages, channel='default'):
         """return the ids of the requests that we sent"""
-        out = ''
-        ids = []
-        for m in messages:
-            method, params = m 
-            request = json.dumps( { 'id':self.message_id, 'method':method, 'params':params } )
-            self.unanswered_requests[self.message_id] = method, params, channel
-            ids.append(self.message_id)
-            # uncomment to debug
-            # print "-->",request
-            self.message_id += 1
-            out += request + '\n'
-        while out:
-            try:
-                sent = self.s.send( out )
-                out = out[sent:]
-            except:
-                # this happens when we get disconnected
-                print_error( "Not connected, cannot send" )
-                return None
+        ids, requests = self.new_requests(messages, channel)
+        # uncomment to debug
+        # print "-->",requests
+        if requests and not (self.connection and self.connection.send_json(requests)):
+            print_error( "Not connected, cannot send" )
+            return None
         return ids
 
 
 
-    def __init__(self, config=None, loop=False):
+    def __init__(self, config=None, loop=False, server=None):
         self.server = None
         self.proxy = None
+        # if server is given, it is used instead of the server of the config, without auto_cycle
+        self.fixed_server = server
 
         if config is None:
             from simple_config import SimpleConfig
@@ -392,17 +580,28 @@ class Interface(threading.Thread):
         self.rtime = 0
         self.bytes_received = 0
         self.is_connected = False
+        self.connection = None
+        self.request_times = {}
+        self.attempts = 0
+        self.failures = 0
+        self.stopping = False
+        self.standby = None    # server, connection
+        self.statuses = {}     # (method, params as json) -> status of a subscription that its channel has stored
 
 
 
     def init_interface(self):
-        if self.config.get('server'):
+        if self.failover():
+            pass
+        elif self.fixed_server:
+            self.init_with_server(self.config, self.fixed_server)
+        elif self.config.get('server'):
             self.init_with_server(self.config)
         else:
             if self.config.get('auto_cycle') is None:
                 self.config.set_key('auto_cycle', True, False)
 
-        if not self.is_connected and self.config.get('auto_cycle'):
+        if not self.is_connected and self.config.get('auto_cycle') and not self.fixed_server:
             print_msg("Using random server...")
             servers_tcp = DEFAULT_SERVERS[:]
             servers_http = DEFAULT_HTTP_SERVERS[:] 
@@ -435,9 +634,9 @@ class Interface(threading.Thread):
             #print_error("Failed to connect " + self.connection_msg)
 
 
-    def init_with_server(self, config):
+    def init_with_server(self, config, server=None):
             
-        s = config.get('server')
+        s = server or config.get('server')
         host, port, protocol = s.split(':')
         port = int(port)
 
@@ -479,8 +678,19 @@ class Interface(threading.Thread):
 
         return out
 
+    def set_status(self, method, params, status):
+        """the status of a subscription that its channel has stored, e.g. the status of the
+        history stored in the wallet. a response with the same status is not passed to the
+        channel, so that subscribing again after a reconnection only reports the changes.
+        only the channel calls this, once it has acted on a status"""
+        key = method, json.dumps(params)
+        with self.lock:
+            self.statuses[key] = status
+
     def resend_subscriptions(self):
-        for channel, messages in self.subscriptions.items():
+        with self.lock:
+            subscriptions = self.subscriptions.items()
+        for channel, messages in subscriptions:
             if messages:
                 self.send(messages, channel)
 
@@ -516,16 +726,22 @@ class Interface(threading.Thread):
             print "changing server:", server, proxy
             self.server = server
             self.proxy = proxy
-            if self.protocol in 'st' and self.s:
-                self.s.shutdown(socket.SHUT_RDWR)
-                self.s.close()
+            if self.protocol in 'st' and self.connection:
+                self.connection.close()
+            self.drop_standby()
             self.is_connected = False  # this exits the polling loop
+            if self.protocol in 'gh':
+                self.poll_event.set()
             self.trigger_callback('disconnecting') # for actively disconnecting
 
     def stop(self):
-        if self.protocol in 'st' and self.s:
-            self.s.shutdown(socket.SHUT_RDWR)
-            self.s.close()
+        self.stopping = True
+        self.drop_standby()
+        if self.protocol in 'st' and self.connection:
+            self.connection.close()
+        elif self.protocol in 'gh':
+            self.is_connected = False
+            self.poll_event.set()
 
 
     def get_servers_list(self):
@@ -562,28 +778,30 @@ class Interface(threading.Thread):
         with self.lock:
             for k, v in self.unanswered_requests.items():
                 a, b, c = v
-                if c == channel: result.append(k)
+                if channel in c: result.append(k)
         return result
 
     def is_up_to_date(self, channel):
         return self.is_empty(channel) and not self.get_pending_requests(channel)
 
 
+    def send_request(self, method, params):
+        """send a request, and return a Future for its result"""
+        return self.send_requests([(method, params)])[0]
+
+    def send_requests(self, requests):
+        """send requests, and return a list of Futures for their results.
+        subscriptions need a channel, for the notifications"""
+        for method, params in requests:
+            if method[-10:] == '.subscribe':
+                raise BaseException('cannot subscribe without a channel: %s'%method)
+        futures = [ Future() for r in requests ]
+        self.send(requests, futures)
+        return futures
+
     def synchronous_get(self, requests, timeout=100000000):
-        # todo: use generators, unanswered_requests should be a list of arrays...
-        ids = self.send(requests)
-        id2 = ids[:]
-        res = {}
-        while ids:
-            r = self.responses['default'].get(True, timeout)
-            _id = r.get('id')
-            if _id in ids:
-                ids.remove(_id)
-                res[_id] = r.get('result')
-        out = []
-        for _id in id2:
-            out.append(res[_id])
-        return out
+        futures = self.send_requests(requests)
+        return [ f.result(timeout) for f in futures ]
 
 
     def start(self):
@@ -592,16 +810,25 @@ class Interface(threading.Thread):
         self.connect_event.wait()
 
     def run(self):
+        delay = RECONNECT_MIN
         while True:
             self.init_interface()
             if self.is_connected:
+                t = time.time()
                 self.resend_subscriptions()
+                self.start_standby()
                 self.run_tcp() if self.protocol in 'st' else self.run_http()
+                if time.time() - t > RECONNECT_MAX:
+                    delay = RECONNECT_MIN
 
             self.trigger_callback('disconnected')
+            self.fail_requests('disconnected')
 
-            if not self.loop: break
-            time.sleep(5)
+            if not self.loop or self.stopping: break
+            if self.standby: continue
+            # exponential backoff, with jitter so that clients do not reconnect all at once
+            time.sleep(delay * random.uniform(0.5, 1))
+            delay = min(2*delay, RECONNECT_MAX)
 
 
 
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+#
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2013 thomasv@gitorious
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+import random, threading, Queue
+
+from interface import Interface, DEFAULT_SERVERS
+from transport import Future
+from util import print_error
+
+
+class InterfacePool:
+    """
+    Interfaces to several servers, used like a single Interface.
+
+    Address requests (blockchain.address.*) are sharded across the
+    connected servers: each address sticks to the server it was first
+    sent to, as long as that server is connected. The other requests go
+    to the server with the lowest round trip time. All the interfaces
+    put their responses in the same channels.
+
+    When a server disconnects, its unanswered requests and its
+    subscriptions are sent to the other servers. Servers that fail too
+    often are replaced with peers from server.peers.subscribe.
+
+    server, host, port, protocol, proxy and connection_msg are those of
+    the primary server: the first one that connected, until it
+    disconnects. get_bytes_received counts the bytes of all the servers.
+
+    The pool is only an API for now: the client and the GUIs use a single
+    Interface, and they expect the server settings (set_server, the
+    server list) of an Interface, which the pool does not have.
+    """
+
+    def __init__(self, config=None, size=None):
+        if config is None:
+            from simple_config import SimpleConfig
+            config = SimpleConfig()
+        self.config = config
+        self.size = size or config.get('pool_size', 3)
+        self.lock = threading.Lock()
+        self.members = {}             # server -> Interface
+        self.address_servers = {}     # address -> server
+        self.pending = []             # (messages, channel) waiting for a connected server
+        self.responses = {}
+        self.responses['default'] = Queue.Queue()
+        self.callbacks = {}
+        self.servers = {}             # peers of the servers
+        self.is_connected = False
+        self.connect_event = threading.Event()
+        self.set_primary(None)
+
+    def set_primary(self, member):
+        self.primary = member
+        for name in ['server', 'host', 'port', 'protocol', 'proxy', 'connection_msg']:
+            setattr(self, name, getattr(member, name, None))
+
+    def get_bytes_received(self):
+        return sum(m.bytes_received for m in self.members.values())
+
+    def register_callback(self, event, callback):
+        with self.lock:
+            if not self.callbacks.get(event):
+                self.callbacks[event] = []
+            self.callbacks[event].append(callback)
+
+    def trigger_callback(self, event):
+        with self.lock:
+            callbacks = self.callbacks.get(event,[])[:]
+        if callbacks:
+            [callback() for callback in callbacks]
+
+
+    def start(self):
+        servers = self.config.get('pool_servers')
+        if not servers:
+            servers = random.sample(DEFAULT_SERVERS, min(self.size, len(DEFAULT_SERVERS)))
+        for server in servers:
+            self.add_server(server)
+        # wait until a server is connected, or all of them failed
+        for member in self.members.values():
+            member.connect_event.wait()
+        self.connect_event.set()
+
+    def add_server(self, server):
+        with self.lock:
+            if server in self.members: return
+            member = Interface(self.config, True, server)
+            member.responses = self.responses
+            self.members[server] = member
+        member.register_callback('connected', lambda: self.on_connected(member))
+        member.register_callback('disconnected', lambda: self.on_disconnected(member))
+        member.register_callback('peers', lambda: self.on_peers(member))
+        # do not wait for the connection, this may be called from the event loop
+        threading.Thread.start(member)
+
+    def remove_server(self, server):
+        with self.lock:
+            member = self.members.pop(server, None)
+            if member is not None and self.primary is member:
+                self.set_primary(None)
+        if member:
+            member.loop = False
+            member.stop()
+
+    def stop(self):
+        for server in self.members.keys():
+            self.remove_server(server)
+
+    def on_connected(self, member):
+        print_error("pool: connected to", member.server)
+        self.is_connected = True
+        with self.lock:
+            if self.primary is None:
+                self.set_primary(member)
+        member.send([('server.peers.subscribe',[])])
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for messages, channel in pending:
+            self.send(messages, channel)
+        self.trigger_callback('connected')
+
+    def on_disconnected(self, member):
+        # move the requests and the subscriptions of the server to the other ones
+        requests = member.pop_unanswered_requests()
+        with member.lock:
+            subscriptions, member.subscriptions = member.subscriptions, {}
+        with self.lock:
+            for address, server in self.address_servers.items():
+                if server == member.fixed_server:
+                    self.address_servers.pop(address)
+        for channel, messages in subscriptions.items():
+            self.send(messages, channel)
+        for method, params, channels in requests:
+            for channel in channels:
+                if method[-10:] == '.subscribe' and not isinstance(channel, Future):
+                    continue
+                self.send([(method, params)], [channel] if isinstance(channel, Future) else channel)
+
+        members = self.connected_members()
+        self.is_connected = bool(members)
+        with self.lock:
+            if self.primary is member:
+                self.set_primary(members[0] if members else None)
+        if member.attempts >= 3 and member.failures > member.attempts / 2 and self.servers:
+            print_error("pool: removing", member.server)
+            self.remove_server(member.fixed_server)
+            self.fill()
+        if not self.is_connected:
+            self.trigger_callback('disconnected')
+
+    def on_peers(self, member):
+        self.servers = member.servers
+        self.trigger_callback('peers')
+        self.fill()
+
+    def fill(self):
+        """ add peers until there are self.size servers """
+        candidates = []
+        for host, v in self.servers.items():
+            ports = dict(v['ports'])
+            protocol = 's' if 's' in ports else 't'
+            if protocol in ports:
+                candidates.append('%s:%s:%s'%(host, ports[protocol], protocol))
+        random.shuffle(candidates)
+        for server in candidates:
+            if len(self.members) >= self.size: break
+            if server not in self.members:
+                self.add_server(server)
+
+
+    def connected_members(self):
+        with self.lock:
+            return [ m for m in self.members.values() if m.is_connected ]
+
+    def best_member(self, members=None):
+        """ the connected server with the lowest round trip time, avoiding servers that fail often """
+        if members is None: members = self.connected_members()
+        if not members: return None
+        return min(members, key=lambda m: (m.failures > m.attempts / 2, m.rtime))
+
+    def address_member(self, address, members):
+        with self.lock:
+            member = self.members.get(self.address_servers.get(address))
+            if member not in members:
+                members = sorted(members, key=lambda m: m.fixed_server)
+                member = members[hash(address) % len(members)]
+                self.address_servers[address] = member.fixed_server
+        return member
+
+    def get_member(self, method, params, members):
+        if method.startswith('blockchain.address.') and params:
+            return self.address_member(params[0], members)
+        return self.best_member(members)
+
+    def send(self, messages, channel='default'):
+        members = self.connected_members()
+        if not members:
+            with self.lock:
+                self.pending.append((messages, channel))
+            return []
+
+        # group the messages by server, with their channels
+        groups = {}
+        for i, message in enumerate(messages):
+            method, params = message
+            member = self.get_member(method, params, members)
+            m, c = groups.setdefault(member, ([], []))
+            m.append(message)
+            c.append(channel[i] if type(channel) == list else channel)
+
+        ids = []
+        for member, (m, c) in groups.items():
+            out = member.send(m, c if type(channel) == list else channel)
+            if out: ids += out
+        return ids
+
+    def set_status(self, method, params, status):
+        for member in self.members.values():
+            member.set_status(method, params, status)
+
+    def resend_subscriptions(self):
+        for member in self.connected_members():
+            member.resend_subscriptions()
+
+
+    def send_request(self, method, params):
+        """send a request, and return a Future for its result"""
+        return self.send_requests([(method, params)])[0]
+
+    def send_requests(self, requests):
+        for method, params in requests:
+            if method[-10:] == '.subscribe':
+                raise BaseException('cannot subscribe without a channel: %s'%method)
+        futures = [ Future() for r in requests ]
+        self.send(requests, futures)
+        return futures
+
+    def synchronous_get(self, requests, timeout=100000000):
+        futures = self.send_requests(requests)
+        return [ f.result(timeout) for f in futures ]
+
+
+    def register_channel(self, channel):
+        with self.lock:
+            self.responses[channel] = Queue.Queue()
+
+    def get_response(self, channel='default', block=True, timeout=10000000000):
+        return self.responses[channel].get(block, timeout)
+
+    def poke(self, channel):
+        self.responses[channel].put(None)
+
+    def is_empty(self, channel):
+        q = self.responses.get(channel)
+        if q:
+            return q.empty()
+        else:
+            return True
+
+    def get_pending_requests(self, channel):
+        result = []
+        for member in self.members.values():
+            result += member.get_pending_requests(channel)
+        with self.lock:
+            for messages, c in self.pending:
+                if c == channel: result += messages
+        return result
+
+    def is_up_to_date(self, channel):
+        return self.is_empty(channel) and not self.get_pending_requests(channel)
+
+    def get_stats(self):
+        """ server -> statistics """
+        stats = {}
+        with self.lock:
+            members = self.members.items()
+            addresses = self.address_servers.values()
+        for server, m in members:
+            stats[server] = { 'connected':m.is_connected, 'rtime':m.rtime, 'attempts':m.attempts, 'failures':m.failures,
+                              'addresses':addresses.count(server), 'pending':len(m.unanswered_requests) }
+        return stats
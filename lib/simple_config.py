@@ -1,6 +1,7 @@
 import json, ast
 import os, ast
 from util import user_dir, print_error
+from wallet_storage import get_storage
 
 from version import ELECTRUM_VERSION, SEED_VERSION
 
@@ -31,6 +32,7 @@ a SimpleConfig instance then reads the wallet file.
 
         self.wallet_config = {}
         self.wallet_file_exists = False
+        self.storage = None
         self.init_path(self.options_config.get('wallet_path'))
         print_error( "path", self.path )
         if self.path:
@@ -184,17 +186,18 @@ a SimpleConfig instance then reads the wallet file.
 
 
 
+    def get_storage(self):
+        """Return the storage backend of the wallet file; 'wallet_storage' is 'file' (the default) or 'sqlite'."""
+        if self.storage is None or self.storage.path != self.path:
+            self.storage = get_storage(self.path, self.get('wallet_storage'))
+        return self.storage
+
+
     def read_wallet_config(self, path):
         """Read the contents of the wallet file."""
-        try:
-            with open(self.path, "r") as f:
-                data = f.read()
-        except IOError:
+        d = self.get_storage().read()
+        if d is None:
             return
-        try:
-            d = ast.literal_eval( data )  #parse raw data from reading wallet file
-        except:
-            raise IOError("Cannot read wallet file.")
 
         self.wallet_config = d
         self.wallet_file_exists = True
@@ -210,10 +213,7 @@ a SimpleConfig instance then reads the wallet file.
         if self.wallet_config.get('master_public_key') is None: 
             return
 
-        s = repr(self.wallet_config)
-        f = open(self.path,"w")
-        f.write( s )
-        f.close()
+        self.get_storage().write(self.wallet_config)
         if self.get('gui') != 'android':
             import stat
             os.chmod(self.path,stat.S_IREAD | stat.S_IWRITE)
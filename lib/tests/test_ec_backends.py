@@ -0,0 +1,132 @@
+"""Check each EC backend against the pure python ecdsa module.
+
+run from the top of the source tree:  python -m unittest discover -s lib/tests -t .
+A backend that cannot be loaded (e.g. libsecp256k1 is not installed) is skipped."""
+
+import unittest, hashlib
+import ecdsa
+from ecdsa.util import number_to_string, string_to_number, sigencode_string, sigdecode_string
+
+from lib import bitcoin
+
+
+curve = ecdsa.SECP256k1
+G = curve.generator
+order = curve.order
+
+
+def ref_pubkey(secexp):
+    return chr(4) + ecdsa.SigningKey.from_secret_exponent(secexp, curve=curve).get_verifying_key().to_string()
+
+def ref_point(pubkey):
+    return ecdsa.VerifyingKey.from_string(pubkey[1:], curve=curve).pubkey.point
+
+def ref_ser(point):
+    return chr(4) + number_to_string(point.x(), order) + number_to_string(point.y(), order)
+
+def ref_verify(digest, r, s, pubkey):
+    vk = ecdsa.VerifyingKey.from_string(pubkey[1:], curve=curve)
+    try:
+        return vk.verify_digest(sigencode_string(r, s, order), digest, sigdecode=sigdecode_string)
+    except ecdsa.BadSignatureError:
+        return False
+
+
+def secexp(i):
+    return string_to_number(hashlib.sha256('secret %d'%i).digest()) % order
+
+def tweak(i):
+    return string_to_number(hashlib.sha256('tweak %d'%i).digest()) % order
+
+
+class ECBackendTests:
+    """ the tests of a backend. the subclasses give backend_name """
+
+    backend_name = None
+
+    def setUp(self):
+        try:
+            self.backend = bitcoin.ec_backends[self.backend_name]()
+        except BaseException, e:
+            self.skipTest("%s not available: %s"%(self.backend_name, e))
+
+    def tearDown(self):
+        bitcoin.set_ec_backend()
+
+    def test_get_pubkey(self):
+        for i in range(10):
+            self.assertEqual(self.backend.get_pubkey(secexp(i)), ref_pubkey(secexp(i)))
+        self.assertEqual(self.backend.get_pubkey(1), ref_ser(G))
+
+    def test_pubkey_tweak_add(self):
+        for i in range(10):
+            pubkey = ref_pubkey(secexp(i))
+            expected = ref_ser(ref_point(pubkey) + G * tweak(i))
+            self.assertEqual(self.backend.pubkey_tweak_add(pubkey, tweak(i)), expected)
+            # the tweaked key is the public key of the tweaked secret
+            self.assertEqual(expected, ref_pubkey((secexp(i) + tweak(i)) % order))
+
+    def test_pubkey_tweak_mul(self):
+        for i in range(10):
+            pubkey = ref_pubkey(secexp(i))
+            expected = ref_ser(ref_point(pubkey) * tweak(i))
+            self.assertEqual(self.backend.pubkey_tweak_mul(pubkey, tweak(i)), expected)
+
+    def test_sign(self):
+        for i in range(10):
+            digest = bitcoin.Hash('message %d'%i)
+            r, s = self.backend.sign(digest, secexp(i))
+            self.assertTrue(ref_verify(digest, r, s, ref_pubkey(secexp(i))))
+            self.assertFalse(ref_verify(digest, r, s, ref_pubkey(secexp(i + 1))))
+
+    def test_verify(self):
+        for i in range(10):
+            digest = bitcoin.Hash('message %d'%i)
+            pubkey = ref_pubkey(secexp(i))
+            r, s = ecdsa.SigningKey.from_secret_exponent(secexp(i), curve=curve).sign_digest(digest, sigencode=lambda r, s, order: (r, s))
+            self.assertTrue(self.backend.verify(digest, r, s, pubkey))
+            # the signature with the other s is valid too
+            self.assertEqual(self.backend.verify(digest, r, order - s, pubkey), ref_verify(digest, r, order - s, pubkey))
+            self.assertFalse(self.backend.verify(bitcoin.Hash(digest), r, s, pubkey))
+            self.assertFalse(self.backend.verify(digest, r, s, ref_pubkey(secexp(i + 1))))
+            self.assertFalse(self.backend.verify(digest, 0, s, pubkey))
+            self.assertFalse(self.backend.verify(digest, r, order, pubkey))
+
+    def test_verify_message(self):
+        for i in range(5):
+            key = bitcoin.EC_KEY(secexp(i))
+            for compressed in [False, True]:
+                address = bitcoin.public_key_to_bc_address(bitcoin.GetPubKey(key.pubkey, compressed))
+                other = bitcoin.public_key_to_bc_address(bitcoin.GetPubKey(bitcoin.EC_KEY(secexp(i + 1)).pubkey, compressed))
+                bitcoin.set_ec_backend('ecdsa')
+                signature = key.sign_message('message %d'%i, compressed, address)
+                cases = [ (address, signature, 'message %d'%i), (address, signature, 'other message'), (other, signature, 'message %d'%i) ]
+                expected = [ self.message_result(case) for case in cases ]
+                self.assertEqual(expected, [True, False, False])
+                bitcoin.set_ec_backend(self.backend_name)
+                self.assertEqual([ self.message_result(case) for case in cases ], expected)
+                # a signature made with this backend is valid with the reference
+                signature = key.sign_message('message %d'%i, compressed, address)
+                bitcoin.set_ec_backend('ecdsa')
+                self.assertTrue(self.message_result((address, signature, 'message %d'%i)))
+
+    def message_result(self, case):
+        try:
+            bitcoin.EC_KEY.verify_message(*case)
+            return True
+        except BaseException:
+            return False
+
+
+class TestSecp256k1Backend(ECBackendTests, unittest.TestCase):
+    backend_name = 'secp256k1'
+
+class TestOpenSSLBackend(ECBackendTests, unittest.TestCase):
+    backend_name = 'openssl'
+
+class TestEcdsaBackend(ECBackendTests, unittest.TestCase):
+    backend_name = 'ecdsa'
+
+
+if __name__ == '__main__':
+    unittest.main()
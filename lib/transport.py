@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+#
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2013 thomasv@gitorious
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+# An event loop for the TCP connections to the servers.
+#
+# A single thread runs the sockets of all the connections with select.
+# The sockets are non-blocking: each connection reads all the available
+# data into a bytearray, and decodes the complete lines of json it holds.
+# Other threads send data by appending it to the output buffer of a
+# connection; the loop writes it when the socket is writable.
+#
+# HTTP servers are not run by the loop: requests are synchronous, on
+# keep-alive connections taken from a HTTPConnectionPool.
+
+import socket, select, ssl, errno, heapq, threading, time, json, traceback, sys, httplib
+from util import print_error
+
+
+READ_SIZE = 65536
+
+
+class Future:
+    """ the result of a request, set by the thread that receives it """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.callbacks = []
+        self.value = None
+        self.error = None
+
+    def set_result(self, result):
+        self.finish(result, None)
+
+    def set_error(self, error):
+        self.finish(None, error)
+
+    def finish(self, value, error):
+        with self.lock:
+            if self.event.is_set(): return
+            self.value = value
+            self.error = error
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def done(self):
+        return self.event.is_set()
+
+    def result(self, timeout=None):
+        if not self.event.wait(timeout):
+            raise BaseException("timeout")
+        if self.error is not None:
+            raise BaseException(self.error)
+        return self.value
+
+    def add_done_callback(self, callback):
+        """ call callback(future) when the result is set, in the thread that sets it """
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+
+def socketpair():
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+    # windows
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    a = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    a.connect(server.getsockname())
+    b, address = server.accept()
+    server.close()
+    return a, b
+
+
+class EventLoop(threading.Thread):
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lock = threading.Lock()
+        self.connections = {}     # socket -> connection, only used by the loop thread
+        self.calls = []
+        self.timers = []          # heap of (time, sequence number, timer)
+        self.sequence = 0
+        self.wakeup_r, self.wakeup_w = socketpair()
+        self.wakeup_r.setblocking(0)
+        self.wakeup_w.setblocking(0)
+
+    def call_soon(self, f, *args):
+        """ call f(*args) in the loop thread """
+        with self.lock:
+            self.calls.append((f, args))
+        self.wakeup()
+
+    def call_later(self, delay, f, *args):
+        """ call f(*args) in the loop thread after delay seconds. return a timer for cancel() """
+        timer = [f, args]
+        with self.lock:
+            self.sequence += 1
+            heapq.heappush(self.timers, (time.time() + delay, self.sequence, timer))
+        self.wakeup()
+        return timer
+
+    def cancel(self, timer):
+        timer[0] = None
+
+    def wakeup(self):
+        if threading.current_thread() is self:
+            return
+        try:
+            self.wakeup_w.send('x')
+        except socket.error:
+            # the pipe is full, the loop will wake up anyway
+            pass
+
+    def add(self, connection):
+        self.connections[connection.s] = connection
+
+    def remove(self, connection):
+        self.connections.pop(connection.s, None)
+
+    def run(self):
+        while True:
+            try:
+                self.run_once()
+            except:
+                traceback.print_exc(file=sys.stdout)
+
+    def run_once(self):
+        with self.lock:
+            calls, self.calls = self.calls, []
+        for f, args in calls:
+            self.call(f, args)
+
+        timeout = None
+        now = time.time()
+        while True:
+            with self.lock:
+                if not self.timers:
+                    break
+                t, n, timer = self.timers[0]
+                if t > now:
+                    timeout = t - now
+                    break
+                heapq.heappop(self.timers)
+            f, args = timer
+            if f: self.call(f, args)
+        if self.calls:
+            timeout = 0
+
+        rlist = [self.wakeup_r] + self.connections.keys()
+        wlist = [ s for s, c in self.connections.items() if c.wants_write() ]
+        r, w, x = select.select(rlist, wlist, [], timeout)
+
+        for s in r:
+            if s is self.wakeup_r:
+                try:
+                    while self.wakeup_r.recv(4096): pass
+                except socket.error:
+                    pass
+                continue
+            c = self.connections.get(s)
+            if c: c.on_readable()
+        for s in w:
+            c = self.connections.get(s)
+            if c: c.on_writable()
+
+    def call(self, f, args):
+        try:
+            f(*args)
+        except:
+            traceback.print_exc(file=sys.stdout)
+
+
+event_loop = None
+event_loop_lock = threading.Lock()
+
+def get_event_loop():
+    """ the event loop shared by all connections, started on first use """
+    global event_loop
+    with event_loop_lock:
+        if event_loop is None:
+            event_loop = EventLoop()
+            event_loop.start()
+    return event_loop
+
+
+
+class Connection:
+    """ a connected socket (TCP or SSL) that exchanges lines of json, run by an event loop.
+    on_message(message) and on_close() are called in the loop thread """
+
+    def __init__(self, loop, s, on_message, on_close, on_data=None):
+        self.loop = loop
+        self.s = s
+        self.on_message = on_message
+        self.on_close = on_close
+        self.on_data = on_data
+        self.is_ssl = isinstance(s, ssl.SSLSocket)
+        self.lock = threading.Lock()
+        self.inbuf = bytearray()
+        self.scanned = 0          # inbuf[:scanned] has no newline
+        self.outbuf = bytearray()
+        self.writing = None       # data passed to send, that must be passed again if it fails
+        self.closed = False
+        self.bytes_received = 0
+        self.last_received = time.time()
+        s.setblocking(0)
+        loop.call_soon(loop.add, self)
+
+    def send(self, data):
+        """ queue data for sending. may be called from any thread """
+        with self.lock:
+            if self.closed:
+                return False
+            # if the buffer is not empty, the loop already knows that it has to write it
+            wakeup = not self.outbuf
+            self.outbuf += data
+        if wakeup:
+            self.loop.wakeup()
+        return True
+
+    def send_json(self, messages):
+        return self.send(''.join(json.dumps(m) + '\n' for m in messages))
+
+    def close(self):
+        """ close the connection. may be called from any thread """
+        self.loop.call_soon(self.do_close)
+
+    def wants_write(self):
+        return self.writing is not None or len(self.outbuf) > 0
+
+    def on_writable(self):
+        with self.lock:
+            if self.writing is None:
+                self.writing = str(self.outbuf[:READ_SIZE])
+                del self.outbuf[:READ_SIZE]
+            data = self.writing
+        try:
+            sent = self.s.send(data)
+        except ssl.SSLError, e:
+            if e.args[0] in [ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE]:
+                return
+            print_error("send error:", e)
+            self.do_close()
+            return
+        except socket.error, e:
+            if e.args[0] in [errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR]:
+                return
+            print_error("send error:", e)
+            self.do_close()
+            return
+        self.writing = data[sent:] if sent < len(data) else None
+
+    def on_readable(self):
+        while True:
+            try:
+                data = self.s.recv(READ_SIZE)
+            except ssl.SSLError, e:
+                if e.args[0] in [ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE]:
+                    break
+                print_error("recv error:", e)
+                self.do_close()
+                return
+            except socket.error, e:
+                if e.args[0] in [errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR]:
+                    break
+                print_error("recv error:", e)
+                self.do_close()
+                return
+            if not data:
+                self.process_lines()
+                self.do_close()
+                return
+            self.inbuf += data
+            self.bytes_received += len(data)
+            if self.on_data: self.on_data(len(data))
+            # an ssl socket may hold decrypted data that select does not see
+            if len(data) < READ_SIZE and not (self.is_ssl and self.s.pending()):
+                break
+        self.last_received = time.time()
+        self.process_lines()
+
+    def process_lines(self):
+        buf = self.inbuf
+        start = 0
+        while not self.closed:
+            i = buf.find('\n', max(start, self.scanned))
+            if i == -1:
+                break
+            line = str(buf[start:i])
+            start = i + 1
+            try:
+                message = json.loads(line)
+            except ValueError:
+                print_error("invalid json:", line[:100])
+                continue
+            try:
+                self.on_message(message)
+            except:
+                traceback.print_exc(file=sys.stdout)
+        if start:
+            del buf[:start]
+        self.scanned = len(buf)
+
+    def do_close(self):
+        with self.lock:
+            if self.closed: return
+            self.closed = True
+        self.loop.remove(self)
+        try:
+            self.s.shutdown(socket.SHUT_RDWR)
+        except:
+            pass
+        self.s.close()
+        self.on_close()
+
+
+
+class HTTPConnection(httplib.HTTPConnection):
+    """ a keep-alive connection, that connects through the socket of its pool """
+
+    def __init__(self, pool):
+        httplib.HTTPConnection.__init__(self, pool.host, pool.port)
+        self.pool = pool
+
+    def connect(self):
+        self.sock = self.pool.connect()
+
+
+class HTTPConnectionPool:
+    """ keep-alive connections to a HTTP(S) server, shared by the threads that send requests.
+    proxy is None or the (type, host, port) arguments of socks.socksocket.setproxy """
+
+    def __init__(self, host, port, use_ssl=False, proxy=None, size=2):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.proxy = proxy
+        self.size = size
+        self.lock = threading.Lock()
+        self.idle = []
+        self.connections_made = 0
+
+    def connect(self):
+        if self.proxy is None:
+            s = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+        else:
+            import socks
+            s = socks.socksocket()
+            s.setproxy(*self.proxy)
+        s.settimeout(5)
+        s.connect(( self.host.encode('ascii'), int(self.port)))
+        if self.use_ssl:
+            # wrap the connected socket: wrapping a socksocket before connecting it would bypass the proxy
+            s = ssl.wrap_socket(s, ssl_version=ssl.PROTOCOL_SSLv23)
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.lock:
+            self.connections_made += 1
+        return s
+
+    def request(self, method, url, body=None, headers={}, timeout=None):
+        """ return the response and its body.
+        an idle connection that the server has closed is not used. a GET that fails on an idle
+        connection is sent again once; other requests are not, as the server may have processed them """
+        while True:
+            with self.lock:
+                c = self.idle.pop() if self.idle else None
+            if c is not None and self.is_dropped(c):
+                c.close()
+                continue
+            retry = c is not None and method == 'GET'
+            if c is None:
+                c = HTTPConnection(self)
+            try:
+                if c.sock is None:
+                    c.connect()
+                c.sock.settimeout(timeout)
+                c.request(method, url, body, headers)
+            except (httplib.HTTPException, socket.error):
+                c.close()
+                if retry: continue
+                raise
+            try:
+                response = c.getresponse()
+                data = response.read()
+            except httplib.BadStatusLine:
+                # closed without a response
+                c.close()
+                if retry: continue
+                raise
+            except:
+                c.close()
+                raise
+            if response.will_close:
+                c.close()
+            else:
+                self.release(c)
+            return response, data
+
+    def is_dropped(self, c):
+        """ an idle connection is readable only if the server closed it """
+        if c.sock is None:
+            return True
+        try:
+            return bool(select.select([c.sock], [], [], 0)[0])
+        except (select.error, socket.error, ValueError):
+            return True
+
+    def release(self, c):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(c)
+                return
+        c.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for c in idle:
+            c.close()
@@ -147,3 +147,75 @@ def age(from_date, since_date = None, target_tz=None, include_seconds=False):
         return "about 1 year ago"
     else:
         return "over %d years ago" % (round(distance_in_minutes / 525600))
+
+
+def load_library(name, filenames):
+    import ctypes, ctypes.util
+    path = ctypes.util.find_library(name)
+    for filename in ([path] if path else []) + filenames:
+        try:
+            return ctypes.CDLL(filename)
+        except OSError:
+            continue
+    raise BaseException("%s not found"%name)
+
+
+class LRUCache:
+    """ a dict of limited size, that drops its least recently used items.
+    the order of use is kept in a deque of keys, where a key may appear several times;
+    an item is dropped when its last occurrence leaves the deque """
+
+    def __init__(self, size):
+        import threading
+        from collections import deque
+        self.size = size
+        self.items = {}
+        self.queue = deque()      # keys, least recently used first
+        self.refcount = {}        # key -> number of occurrences in queue
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.items[key]
+            except KeyError:
+                return default
+            self.use(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.use(key)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.items.pop(key, default)
+
+    def use(self, key):
+        # the caller holds the lock
+        self.queue.append(key)
+        self.refcount[key] = self.refcount.get(key, 0) + 1
+        while len(self.items) > self.size:
+            k = self.queue.popleft()
+            self.refcount[k] -= 1
+            if self.refcount[k] == 0:
+                del self.refcount[k]
+                self.items.pop(k, None)
+        if len(self.queue) > 4*self.size + 16:
+            self.compact()
+
+    def compact(self):
+        # keep only the last occurrence of each key. the caller holds the lock
+        from collections import deque
+        queue = deque()
+        seen = set()
+        for k in reversed(self.queue):
+            if k in self.items and k not in seen:
+                seen.add(k)
+                queue.appendleft(k)
+        self.queue = queue
+        self.refcount = dict.fromkeys(seen, 1)
+
+    def __len__(self):
+        return len(self.items)
@@ -17,9 +17,169 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 
-import threading, time, Queue, os, sys, shutil
-from util import user_dir, appdata_dir, print_error
+import threading, time, Queue, os, sys, shutil, struct
+from collections import deque
+from util import user_dir, appdata_dir, print_error, LRUCache
 from bitcoin import *
+from checkpoints import CHECKPOINTS
+
+
+
+# version, prev_block_hash, merkle_root, timestamp, bits, nonce
+header_struct = struct.Struct('<I32s32sIII')
+
+def serialize_header(res):
+    return header_struct.pack(res.get('version'),
+                              hash_decode(res.get('prev_block_hash')),
+                              hash_decode(res.get('merkle_root')),
+                              int(res.get('timestamp')),
+                              int(res.get('bits')),
+                              int(res.get('nonce')))
+
+def header_to_string(res):
+    return serialize_header(res).encode('hex')
+
+def header_from_string(s, offset=0):
+    version, prev_block_hash, merkle_root, timestamp, bits, nonce = header_struct.unpack_from(s, offset)
+    h = {}
+    h['version'] = version
+    h['prev_block_hash'] = hash_encode(prev_block_hash)
+    h['merkle_root'] = hash_encode(merkle_root)
+    h['timestamp'] = timestamp
+    h['bits'] = bits
+    h['nonce'] = nonce
+    return h
+
+def hash_raw_header(raw):
+    return hash_encode(Hash(raw))
+
+def hash_header(header):
+    return hash_raw_header(serialize_header(header))
+
+def bits_to_target(bits):
+    MM = 256*256*256
+    a = bits%MM
+    if a < 0x8000:
+        a *= 256
+    return (a) * pow(2, 8 * (bits/MM - 3))
+
+def target_to_bits(target):
+    MM = 256*256*256
+    c = ("%064X"%target)[2:]
+    i = 31
+    while c[0:2]=="00":
+        c = c[2:]
+        i -= 1
+
+    c = int(c[0:6], 16)
+    if c > 0x800000: 
+        c /= 256
+        i += 1
+
+    return c + MM * i
+
+
+def check_chunk(data):
+    """
+    Check the linkage and proof of work of the headers of a chunk, against
+    the bits of the chunk. This does not need the rest of the chain, so it
+    can run in a worker process. Return the previous hash of the first
+    header, the hash of the last header (both raw), and the bits.
+    """
+    num = len(data)/80
+    if num == 0:
+        return None, None, None
+    first_prev_hash = data[4:36]
+    bits = header_struct.unpack_from(data, 0)[4]
+    target = bits_to_target(bits)
+    previous_hash = first_prev_hash
+    unpack_from = header_struct.unpack_from
+    for i in range(num):
+        version, prev_block_hash, merkle_root, timestamp, _bits, nonce = unpack_from(data, i*80)
+        _hash = Hash(data[i*80:(i+1)*80])
+        assert previous_hash == prev_block_hash
+        assert bits == _bits
+        assert int(_hash[::-1].encode('hex'), 16) < target
+        previous_hash = _hash
+    return first_prev_hash, previous_hash, bits
+
+
+
+class HeaderStore:
+    """ The blockchain_headers file, kept open, with a cache of parsed headers and block hashes. """
+
+    def __init__(self, path, cache_size=4096):
+        self.path = path
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.f = None
+        self.count = 0                 # number of headers in the file
+        self.headers = LRUCache(cache_size)   # height -> parsed header
+        self.hashes = {}               # height -> block hash
+
+    def open(self):
+        with self.lock:
+            self.f = open(self.path,'rb+')
+            self.f.seek(0, 2)
+            self.count = self.f.tell()/80
+
+    def close(self):
+        with self.lock:
+            if self.f:
+                self.f.close()
+                self.f = None
+
+    def height(self):
+        return self.count - 1
+
+    def read_raw(self, height, num=1):
+        """ return num consecutive raw headers, starting at height """
+        with self.lock:
+            if height < 0 or height + num > self.count:
+                return
+            self.f.seek(height*80)
+            data = self.f.read(num*80)
+        # the file has holes below the last checkpoint
+        if data == '\0'*len(data):
+            return
+        return data
+
+    def read_header(self, height):
+        h = self.headers.get(height)
+        if h is not None:
+            return h
+        raw = self.read_raw(height)
+        if raw is None:
+            return
+        h = header_from_string(raw)
+        with self.lock:
+            self.headers.put(height, h)
+        return h
+
+    def get_hash(self, height):
+        _hash = self.hashes.get(height)
+        if _hash is None:
+            raw = self.read_raw(height)
+            if raw is None:
+                return
+            _hash = hash_raw_header(raw)
+            self.hashes[height] = _hash
+        return _hash
+
+    def set_hash(self, height, _hash):
+        self.hashes[height] = _hash
+
+    def write(self, height, data):
+        """ write raw headers at height, replacing what was there """
+        num = len(data)/80
+        with self.lock:
+            self.f.seek(height*80)
+            self.f.write(data)
+            self.f.flush()
+            self.count = max(self.count, height + num)
+            for i in range(height, height + num):
+                self.headers.pop(i, None)
+                self.hashes.pop(i, None)
 
 
 
@@ -41,15 +201,37 @@ class WalletVerifier(threading.Thread):
         self.targets         = config.get('targets',{})           # compute targets
         self.lock = threading.Lock()
         self.pending_headers = [] # headers that have not been verified
+        self.store = None
         self.height = 0
         self.local_height = 0
         self.running = False
         self.headers_url = 'http://headers.electrum.org/blockchain_headers'
+        self.chunk_window = config.get('chunk_window', 8)           # max number of chunk requests in flight
+        self.verifier_processes = config.get('verifier_processes', 0) # number of processes verifying chunks. 0: use this thread
+        self.pool = None
+        self.merkle_window = config.get('merkle_window', 50)        # max number of merkle requests in flight
+        self.merkle_queue = deque()                                 # transactions waiting for a merkle request
+        self.flush_interval = 10                                    # seconds between writes of verified_tx
+        self.verified_tx_dirty = False
+        self.last_flush = 0
+        self.chunks_progress = (0, 0)                               # chunks verified, chunks to download
+        self.checkpoints = {}                                       # height -> block hash, target of the next period or None
+        for c in config.get('checkpoints', CHECKPOINTS):
+            target = c[2] if len(c) > 2 else None
+            assert target is None or c[0] % 2016 == 2015, "checkpoints with a target must be at the end of a period"
+            self.checkpoints[c[0]] = (c[1], target)
+        self.last_checkpoint = -1                                   # the chunks up to this one are only requested when needed
+        if self.checkpoints:
+            height = max(self.checkpoints.keys())
+            # the chunk of a checkpoint without a target is downloaded: its headers give the target of the next period
+            self.last_checkpoint = height/2016 if self.checkpoints[height][1] is not None else height/2016 - 1
+        self.old_chunks = {}                                        # chunks below the last checkpoint -> merkle results waiting for them
+        self.unlinked_chunks = {}                                   # chunks below the last checkpoint, waiting for the next one
 
     def get_confirmations(self, tx):
         """ return the number of confirmations of a monitored transaction. """
         with self.lock:
-            if tx in self.transactions.keys():
+            if tx in self.transactions:
                 if tx in self.verified_tx:
                     height, timestamp = self.verified_tx[tx]
                     conf = (self.local_height - height + 1)
@@ -69,55 +251,125 @@ class WalletVerifier(threading.Thread):
         """ add a transaction to the list of monitored transactions. """
         assert tx_height > 0
         with self.lock:
-            if tx_hash not in self.transactions.keys():
+            if tx_hash not in self.transactions:
                 self.transactions[tx_hash] = tx_height
+                if tx_hash not in self.verified_tx:
+                    self.merkle_queue.append(tx_hash)
 
     def stop(self):
         with self.lock: self.running = False
         self.interface.poke('verifier')
+        self.flush_verified_tx()
+
+    def flush_verified_tx(self):
+        """ write verified_tx to the wallet file, if it changed """
+        with self.lock:
+            if not self.verified_tx_dirty: return
+            self.verified_tx_dirty = False
+        self.config.set_key('verified_tx2', self.verified_tx, True)
+        self.last_flush = time.time()
+
+    def get_merkle_requests(self, requested_merkle):
+        """ take transactions from the queue, up to the size of the window """
+        out = []
+        # refill the window in batches rather than one request at a time
+        if len(requested_merkle) > self.merkle_window/2:
+            return out
+        with self.lock:
+            while self.merkle_queue and len(requested_merkle) + len(out) < self.merkle_window:
+                tx_hash = self.merkle_queue.popleft()
+                if tx_hash in self.verified_tx or tx_hash in requested_merkle:
+                    continue
+                if self.merkle_roots.get(tx_hash) is not None:
+                    continue
+                out.append( (tx_hash, self.transactions[tx_hash]) )
+        return out
 
     def is_running(self):
         with self.lock: return self.running
 
+    def get_chunks_progress(self):
+        """ return the number of chunks verified, and the total number of chunks to download. """
+        with self.lock: return self.chunks_progress
+
+    def set_chunks_progress(self, done, total):
+        with self.lock: self.chunks_progress = (done, total)
+
+    def start_pool(self):
+        import multiprocessing
+        print_error("verifying chunks with %d processes"%self.verifier_processes)
+        self.pool = multiprocessing.Pool(self.verifier_processes)
+
+    def stop_pool(self):
+        self.pool.close()
+        self.pool = None
+
     def run(self):
 
         self.init_headers_file()
+        self.store = HeaderStore(self.path())
+        self.store.open()
         self.set_local_height()
 
         with self.lock:
             self.running = True
-        requested_merkle = []
+        requested_merkle = set()
         requested_chunks = []
         requested_headers = []
+        received_chunks = {}   # chunks received out of order, waiting to be verified
+        first_chunk = None     # index of the first chunk of the download
+        next_chunk = None      # index of the next chunk to verify
+        next_request = None    # index of the next chunk to request
         all_chunks = False
         
         # subscribe to block headers
         self.interface.send([ ('blockchain.headers.subscribe',[])], 'verifier')
 
         while self.is_running():
-            # request missing chunks
-            if not all_chunks and self.height and not requested_chunks:
+            # request missing chunks, keeping up to chunk_window requests in flight
+            if not all_chunks and self.height:
+
+                if next_chunk is None:
+                    if self.local_height + 50 < self.height:
+                        # the headers below the last checkpoint are not needed
+                        first_chunk = next_chunk = next_request = max((self.local_height + 1)/2016, self.last_checkpoint + 1)
+                        if self.verifier_processes and self.pool is None:
+                            self.start_pool()
+                    else:
+                        all_chunks = True
+                        print_error("downloaded all chunks")
+                        if self.pool:
+                            self.stop_pool()
 
-                if self.local_height + 50 < self.height:
-                    min_index = (self.local_height + 1)/2016
+                if next_chunk is not None:
                     max_index = (self.height + 1)/2016
-                    for i in range(min_index, max_index + 1):
-                        print_error( "requesting chunk", i )
-                        self.interface.send([ ('blockchain.block.get_chunk',[i])], 'verifier')
-                        requested_chunks.append(i)
-                        break
-                else:
-                    all_chunks = True
-                    print_error("downloaded all chunks")
+                    messages = []
+                    while next_request <= max_index and len(requested_chunks) + len(received_chunks) < self.chunk_window:
+                        print_error( "requesting chunk", next_request )
+                        messages.append( ('blockchain.block.get_chunk',[next_request]) )
+                        requested_chunks.append(next_request)
+                        next_request += 1
+                    if messages:
+                        self.interface.send(messages, 'verifier')
+
+                    if next_chunk > max_index and not requested_chunks:
+                        # check again, the blockchain might have grown during the download
+                        next_chunk = None
+                        continue
 
             # request missing tx
             if all_chunks:
-                for tx_hash, tx_height in self.transactions.items():
-                    if tx_hash not in self.verified_tx:
-                        if self.merkle_roots.get(tx_hash) is None and tx_hash not in requested_merkle:
-                            print_error('requesting merkle', tx_hash)
-                            self.interface.send([ ('blockchain.transaction.get_merkle',[tx_hash, tx_height]) ], 'verifier')
-                            requested_merkle.append(tx_hash)
+                messages = []
+                for tx_hash, tx_height in self.get_merkle_requests(requested_merkle):
+                    print_error('requesting merkle', tx_hash)
+                    messages.append( ('blockchain.transaction.get_merkle',[tx_hash, tx_height]) )
+                    requested_merkle.add(tx_hash)
+                if messages:
+                    self.interface.send(messages, 'verifier')
+
+            # write verified transactions periodically, and when there is nothing left to verify
+            if self.verified_tx_dirty and (not requested_merkle or time.time() - self.last_flush > self.flush_interval):
+                self.flush_verified_tx()
 
             # process pending headers
             if self.pending_headers and all_chunks:
@@ -157,8 +409,26 @@ class WalletVerifier(threading.Thread):
 
             elif method == 'blockchain.block.get_chunk':
                 index = params[0]
-                self.verify_chunk(index, result)
+                if index in self.old_chunks:
+                    # a chunk below the last checkpoint, needed to verify a transaction
+                    self.receive_old_chunk(index, result.decode('hex'))
+                    continue
+
                 requested_chunks.remove(index)
+                if self.pool:
+                    data = result.decode('hex')
+                    received_chunks[index] = (data, self.pool.apply_async(check_chunk, (data,)))
+                else:
+                    received_chunks[index] = result
+                # connect chunks in order; each one needs the last header of the previous chunk
+                while next_chunk in received_chunks:
+                    if self.pool:
+                        data, check_result = received_chunks.pop(next_chunk)
+                        self.connect_chunk(next_chunk, data, check_result.get())
+                    else:
+                        self.verify_chunk(next_chunk, received_chunks.pop(next_chunk))
+                    next_chunk += 1
+                self.set_chunks_progress(next_chunk - first_chunk, (self.height + 1)/2016 + 1 - first_chunk)
 
             elif method in ['blockchain.headers.subscribe', 'blockchain.block.get_header']:
 
@@ -178,45 +448,105 @@ class WalletVerifier(threading.Thread):
         tx_height = result.get('block_height')
         self.merkle_roots[tx_hash] = self.hash_merkle_root(result['merkle'], tx_hash, result.get('pos'))
         header = self.read_header(tx_height)
-        if not header: return
+        if not header:
+            if tx_height/2016 <= self.last_checkpoint:
+                self.request_old_chunk(tx_height/2016, tx_hash, result)
+            return
         assert header.get('merkle_root') == self.merkle_roots[tx_hash]
         # we passed all the tests
-        header = self.read_header(tx_height)
         timestamp = header.get('timestamp')
-        self.verified_tx[tx_hash] = (tx_height, timestamp)
+        with self.lock:
+            self.verified_tx[tx_hash] = (tx_height, timestamp)
+            self.verified_tx_dirty = True
         print_error("verified %s"%tx_hash)
-        self.config.set_key('verified_tx2', self.verified_tx, True)
         self.interface.trigger_callback('updated')
 
 
+    def request_old_chunk(self, index, tx_hash=None, result=None):
+        """ request a chunk below the last checkpoint. the merkle proof is checked when it arrives. """
+        if index not in self.old_chunks:
+            print_error( "requesting chunk", index )
+            self.old_chunks[index] = []
+            self.interface.send([ ('blockchain.block.get_chunk',[index]) ], 'verifier')
+        if tx_hash:
+            self.old_chunks[index].append( (tx_hash, result) )
+
+    def receive_old_chunk(self, index, data):
+        if not self.is_linked(index, data):
+            # the next chunk will tell the hash of the last block of this one
+            self.unlinked_chunks[index] = data
+            if self.read_header((index + 1)*2016) is None:
+                self.request_old_chunk(index + 1)
+            return
+        while True:
+            try:
+                self.connect_chunk(index, data, check_chunk(data))
+            except BaseException, e:
+                # the transactions waiting for this chunk stay unverified
+                print_error("cannot verify chunk", index, e)
+                self.old_chunks.pop(index, None)
+                break
+            for tx_hash, merkle_result in self.old_chunks.pop(index, []):
+                self.verify_merkle(tx_hash, merkle_result)
+            # the previous chunk can be verified now
+            index -= 1
+            data = self.unlinked_chunks.pop(index, None)
+            if data is None:
+                break
+
+    def is_linked(self, index, data):
+        """ a chunk can be verified if it contains a checkpoint, or if we know the block before it or after it """
+        if index == 0 or self.get_block_hash(index*2016 - 1) is not None:
+            return True
+        if self.get_checkpoints(index, len(data)/80):
+            return True
+        return len(data) == 2016*80 and self.read_header((index + 1)*2016) is not None
+
+    def get_checkpoints(self, index, num):
+        """ the heights of the checkpoints in the first num headers of a chunk """
+        return [ h for h in self.checkpoints.keys() if index*2016 <= h < index*2016 + num ]
+
+
     def verify_chunk(self, index, hexdata):
         data = hexdata.decode('hex')
+        self.connect_chunk(index, data, check_chunk(data))
+
+
+    def connect_chunk(self, index, data, check_result):
+        """ check that a chunk verified by check_chunk follows our chain and has the right difficulty, and save it """
+        first_prev_hash, last_hash, bits = check_result
         height = index*2016
         num = len(data)/80
         print_error("validating headers %d"%height)
+        if num == 0:
+            return
 
         if index == 0:  
             previous_hash = ("0"*64)
         else:
-            prev_header = self.read_header(index*2016-1)
-            if prev_header is None: raise
-            previous_hash = self.hash_header(prev_header)
-
-        bits, target = self.get_target(index)
-
-        for i in range(num):
-            height = index*2016 + i
-            raw_header = data[i*80:(i+1)*80]
-            header = self.header_from_string(raw_header)
-            _hash = self.hash_header(header)
-            assert previous_hash == header.get('prev_block_hash')
-            assert bits == header.get('bits')
-            assert eval('0x'+_hash) < target
-
-            previous_header = header
-            previous_hash = _hash 
+            previous_hash = self.get_block_hash(index*2016-1)
+
+        # the headers are linked by their hashes: a known hash in the chunk, or
+        # right after it, vouches for all of them, including their bits
+        checkpoints = self.get_checkpoints(index, num)
+        for h in checkpoints:
+            i = h - index*2016
+            assert hash_raw_header(data[i*80:(i+1)*80]) == self.checkpoints[h][0]
+        next_header = None
+        if previous_hash is None and num == 2016:
+            next_header = self.read_header((index + 1)*2016)
+        if next_header is not None:
+            assert hash_encode(last_hash) == next_header.get('prev_block_hash')
+
+        if previous_hash is not None:
+            assert hash_decode(previous_hash) == first_prev_hash
+        if not (checkpoints or next_header):
+            if previous_hash is None:
+                raise BaseException("cannot verify chunk %d: it is not linked to a known header"%index)
+            assert bits == self.get_target(index)[0]
 
         self.save_chunk(index, data)
+        self.store.set_hash(index*2016 + num - 1, hash_encode(last_hash))
 
 
     def verify_header(self, header):
@@ -225,18 +555,17 @@ class WalletVerifier(threading.Thread):
 
         height = header.get('block_height')
 
-        prev_header = self.read_header(height -1)
-        if not prev_header:
+        prev_hash = self.get_block_hash(height -1)
+        if not prev_hash:
             # return False to request previous header
             return False
 
-        prev_hash = self.hash_header(prev_header)
         bits, target = self.get_target(height/2016)
         _hash = self.hash_header(header)
         try:
             assert prev_hash == header.get('prev_block_hash')
             assert bits == header.get('bits')
-            assert eval('0x'+_hash) < target
+            assert int(_hash, 16) < target
         except:
             # this can be caused by a reorg.
             print_error("verify header failed"+ repr(header))
@@ -245,12 +574,16 @@ class WalletVerifier(threading.Thread):
                 tx_height, timestamp = item
                 if tx_height >= height:
                     print_error("redoing", tx_hash)
-                    self.verified_tx.pop(tx_hash)
-                    if tx_hash in self.merkle_roots: self.merkle_roots.pop(tx_hash)
+                    with self.lock:
+                        self.verified_tx.pop(tx_hash)
+                        self.verified_tx_dirty = True
+                        if tx_hash in self.merkle_roots: self.merkle_roots.pop(tx_hash)
+                        if tx_hash in self.transactions: self.merkle_queue.append(tx_hash)
             # return False to request previous header.
             return False
 
         self.save_header(header)
+        self.store.set_hash(height, _hash)
         print_error("verify header:", _hash, height)
         return True
         
@@ -258,28 +591,13 @@ class WalletVerifier(threading.Thread):
             
 
     def header_to_string(self, res):
-        s = int_to_hex(res.get('version'),4) \
-            + rev_hex(res.get('prev_block_hash')) \
-            + rev_hex(res.get('merkle_root')) \
-            + int_to_hex(int(res.get('timestamp')),4) \
-            + int_to_hex(int(res.get('bits')),4) \
-            + int_to_hex(int(res.get('nonce')),4)
-        return s
-
+        return header_to_string(res)
 
     def header_from_string(self, s):
-        hex_to_int = lambda s: eval('0x' + s[::-1].encode('hex'))
-        h = {}
-        h['version'] = hex_to_int(s[0:4])
-        h['prev_block_hash'] = hash_encode(s[4:36])
-        h['merkle_root'] = hash_encode(s[36:68])
-        h['timestamp'] = hex_to_int(s[68:72])
-        h['bits'] = hex_to_int(s[72:76])
-        h['nonce'] = hex_to_int(s[76:80])
-        return h
+        return header_from_string(s)
 
     def hash_header(self, header):
-        return rev_hex(Hash(self.header_to_string(header).decode('hex')).encode('hex'))
+        return hash_header(header)
 
     def hash_merkle_root(self, merkle_s, target_hash, pos):
         h = hash_decode(target_hash)
@@ -297,7 +615,12 @@ class WalletVerifier(threading.Thread):
         filename = self.path()
         if os.path.exists(filename):
             return
-        
+
+        if self.checkpoints:
+            # only the headers above the last checkpoint are needed
+            open(filename,'wb+').close()
+            return
+
         try:
             import urllib, socket
             socket.setdefaulttimeout(30)
@@ -308,43 +631,30 @@ class WalletVerifier(threading.Thread):
             open(filename,'wb+').close()
 
     def save_chunk(self, index, chunk):
-        filename = self.path()
-        f = open(filename,'rb+')
-        f.seek(index*2016*80)
-        h = f.write(chunk)
-        f.close()
+        self.store.write(index*2016, chunk)
         self.set_local_height()
 
     def save_header(self, header):
-        data = self.header_to_string(header).decode('hex')
+        data = serialize_header(header)
         assert len(data) == 80
         height = header.get('block_height')
-        filename = self.path()
-        f = open(filename,'rb+')
-        f.seek(height*80)
-        h = f.write(data)
-        f.close()
+        self.store.write(height, data)
         self.set_local_height()
 
 
     def set_local_height(self):
-        name = self.path()
-        if os.path.exists(name):
-            h = os.path.getsize(name)/80 - 1
-            if self.local_height != h:
-                self.local_height = h
+        h = self.store.height()
+        if self.local_height != h:
+            self.local_height = h
 
 
     def read_header(self, block_height):
-        name = self.path()
-        if os.path.exists(name):
-            f = open(name,'rb')
-            f.seek(block_height*80)
-            h = f.read(80)
-            f.close()
-            if len(h) == 80:
-                h = self.header_from_string(h)
-                return h 
+        return self.store.read_header(block_height)
+
+    def get_block_hash(self, block_height):
+        if block_height in self.checkpoints:
+            return self.checkpoints[block_height][0]
+        return self.store.get_hash(block_height)
 
 
     def get_target(self, index):
@@ -352,8 +662,15 @@ class WalletVerifier(threading.Thread):
         max_target = 0x00000000FFFF0000000000000000000000000000000000000000000000000000
         if index == 0: return 0x1d00ffff, max_target
 
+        # the checkpoint at the end of the previous period may have the target
+        target = self.checkpoints.get(index*2016 - 1, (None, None))[1]
+        if target is not None:
+            return target_to_bits(target), target
+
         first = self.read_header((index-1)*2016)
         last = self.read_header(index*2016-1)
+        if first is None or last is None:
+            raise BaseException("cannot compute the target of period %d: missing headers"%index)
         
         nActualTimespan = last.get('timestamp') - first.get('timestamp')
         nTargetTimespan = 14*24*60*60
@@ -362,27 +679,9 @@ class WalletVerifier(threading.Thread):
 
         bits = last.get('bits') 
         # convert to bignum
-        MM = 256*256*256
-        a = bits%MM
-        if a < 0x8000:
-            a *= 256
-        target = (a) * pow(2, 8 * (bits/MM - 3))
+        target = bits_to_target(bits)
 
         # new target
         new_target = min( max_target, (target * nActualTimespan)/nTargetTimespan )
-        
-        # convert it to bits
-        c = ("%064X"%new_target)[2:]
-        i = 31
-        while c[0:2]=="00":
-            c = c[2:]
-            i -= 1
-
-        c = eval('0x'+c[0:6])
-        if c > 0x800000: 
-            c /= 256
-            i += 1
-
-        new_bits = c + MM * i
-        return new_bits, new_target
+        return target_to_bits(new_target), new_target
 
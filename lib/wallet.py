@@ -96,20 +96,54 @@ class Wallet:
         self.sequences = {}
         self.sequences[0] = ElectrumSequence(self.config.get('master_public_key'))
 
+        # (account, for_change, n) -> (public keys, address, redeemScript), valid for the master keys in derived_keys_mpk
+        self.derived_keys = config.get('derived_keys', {})
+        if config.get('derived_keys_mpk', {}) != self.get_master_keys():
+            self.derived_keys = {}
+
         if self.accounts.get(0) is None:
             self.accounts[0] = { 0:[], 1:[], 'name':'Main account' }
 
+        # address index, kept in sync with accounts and imported_keys
+        self.my_addresses = set()    # all addresses of the wallet, including imported
+        self.address_index = {}      # address -> (account, for_change, n)
+        self.init_address_index()
+
         self.transactions = {}
+        # what is saved of the transactions; updated when a transaction is added or removed
+        self.tx_raw = {}
+        self.tx_summary = {}
         tx = config.get('transactions',{})
+        tx_summary = config.get('tx_summary',{})
         try:
-            for k,v in tx.items(): self.transactions[k] = Transaction(v)
+            for k,v in tx.items():
+                self.transactions[k] = Transaction(v, tx_summary.get(k))
+                # parse now if there is no summary, so that errors are caught here
+                self.tx_summary[k] = self.transactions[k].get_summary()
+                self.tx_raw[k] = v
         except:
             print_msg("Warning: Cannot deserialize transactions. skipping")
         
         # not saved
         self.prevout_values = {}     # my own transaction outputs
-        self.spent_outputs = []
+        self.spent_outputs = set()
+
+        # utxo set and balances, updated incrementally
+        self.utxo = {}               # outpoint -> coin
+        self.addr_coins = {}         # address -> list of outpoints, in history order
+        self.addr_balance = {}       # address -> (confirmed, unconfirmed)
+        self.account_balances = {}   # account -> [confirmed, unconfirmed]
+        self.imported_balance = [0, 0]
+        self.total_balance = [0, 0]
         self.receipt = None          # next receipt
+
+        # signing session: the stretched seed and the decrypted imported keys, see unlock_session
+        self.session_lock = threading.Lock()
+        self.session = None          # (secexp, {address: sec})
+        self.session_timer = None
+        self.unlock_timeout = config.get('unlock_timeout', 300)
+        self.verify_signatures = config.get('verify_signatures', True)    # check each new signature
+        self.signing_processes = config.get('signing_processes', 0)       # sign large transactions in a process pool
         self.banner = ''
 
         # spv
@@ -129,6 +163,10 @@ class Wallet:
         for tx_hash in self.transactions.keys():
             self.update_tx_outputs(tx_hash)
 
+        for addr in self.history.keys():
+            if self.is_mine(addr):
+                self.update_addr_balance(addr)
+
 
     def set_up_to_date(self,b):
         with self.lock: self.up_to_date = b
@@ -151,7 +189,20 @@ class Wallet:
         
         # store the originally requested keypair into the imported keys table
         self.imported_keys[address] = pw_encode(sec, password )
+        self.my_addresses.add(address)
+        with self.session_lock:
+            if self.session:
+                self.session[1][address] = sec
         return address
+
+    def delete_imported_key(self, address):
+        with self.lock:
+            self.clear_addr_balance(address)
+        self.imported_keys.pop(address)
+        self.my_addresses.discard(address)
+        with self.session_lock:
+            if self.session:
+                self.session[1].pop(address, None)
         
 
     def init_seed(self, seed):
@@ -165,9 +216,11 @@ class Wallet:
         mpk = ElectrumSequence.mpk_from_seed(self.seed)
         self.config.set_key('master_public_key', mpk, True)
         self.sequences[0] = ElectrumSequence(mpk)
+        self.derived_keys = {}
 
         self.accounts[0] = { 0:[], 1:[], 'name':'Main account' }
         self.config.set_key('accounts', self.accounts, True)
+        self.init_address_index()
 
 
 
@@ -179,8 +232,25 @@ class Wallet:
         return o
 
 
+    def init_address_index(self):
+        self.my_addresses = set(self.imported_keys.keys())
+        self.address_index = {}
+        for account, a in self.accounts.items():
+            for for_change in [0,1]:
+                for n, address in enumerate(a[for_change]):
+                    self.add_to_address_index(address, account, for_change, n)
+
+    def add_to_address_index(self, address, account, for_change, n):
+        self.address_index[address] = (account, for_change, n)
+        self.my_addresses.add(address)
+
+    def remove_from_address_index(self, address):
+        self.address_index.pop(address, None)
+        if address not in self.imported_keys:
+            self.my_addresses.discard(address)
+
     def is_mine(self, address):
-        return address in self.addresses(True)
+        return address in self.my_addresses
 
     def is_change(self, address):
         #return address in self.change_addresses
@@ -190,53 +260,126 @@ class Wallet:
         return self.sequences[0].master_public_key
 
     def get_address_index(self, address):
-        if address in self.imported_keys.keys():
+        if address in self.imported_keys:
             raise BaseException("imported key")
-        for account in self.accounts.keys():
-            for for_change in [0,1]:
-                addresses = self.accounts[account][for_change]
-                for addr in addresses:
-                    if address == addr:
-                        return account, (for_change, addresses.index(addr))
-        raise BaseException("not found")
+        item = self.address_index.get(address)
+        if item is None:
+            raise BaseException("not found")
+        account, for_change, n = item
+        return account, (for_change, n)
         
 
     def get_public_key(self, address):
         account, sequence = self.get_address_index(address)
-        return self.sequences[account].get_pubkey( sequence )
+        return self.get_derived_keys(account, sequence)[0][0]
+
+    def get_master_keys(self):
+        out = {}
+        for account, s in self.sequences.items():
+            out[account] = (s.master_public_key, s.mpk2 if s.is_p2sh else None)
+        return out
+
+    def get_derived_keys(self, account, sequence):
+        """ return the public keys, address and redeemScript of a sequence. they are derived once, and saved in the wallet """
+        for_change, n = sequence
+        item = self.derived_keys.get( (account, for_change, n) )
+        if item is None:
+            item = self.sequences[account].get_keys(for_change, n, 1)[0]
+            self.derived_keys[ (account, for_change, n) ] = item
+        return item
+
+    def get_input_info(self, account, sequence):
+        """ return the address of the private key of a sequence, and its redeemScript (p2sh) """
+        pubkeys, address, redeemScript = self.get_derived_keys(account, sequence)
+        if redeemScript is None:
+            return address, None
+        return public_key_to_bc_address( pubkeys[0].decode('hex') ), redeemScript
 
 
     def decode_seed(self, password):
         seed = pw_decode(self.seed, password)
         self.sequences[0].check_seed(seed)
         return seed
-        
+
+    def unlock_session(self, password, timeout=None):
+        """
+        Stretch the seed once, and keep the result in memory, with the
+        decrypted imported keys, so that signing (mktx, signrawtransaction,
+        sign_message) does not need the password. Exporting private keys
+        still does. The session ends after timeout seconds (default:
+        'unlock_timeout' in the config), or when lock_session is called.
+        """
+        secexp = self.sequences[0].get_stretched_key( pw_decode(self.seed, password) )
+        imported = {}
+        for address, key in self.imported_keys.items():
+            imported[address] = pw_decode(key, password)
+        if timeout is None:
+            timeout = self.unlock_timeout
+        with self.session_lock:
+            if self.session_timer:
+                self.session_timer.cancel()
+            self.session = (secexp, imported)
+            self.session_timer = threading.Timer(timeout, self.lock_session)
+            self.session_timer.daemon = True
+            self.session_timer.start()
+
+    def lock_session(self):
+        """ end the signing session, and drop the secrets it holds """
+        with self.session_lock:
+            if self.session:
+                self.session[1].clear()
+            self.session = None
+            if self.session_timer:
+                self.session_timer.cancel()
+                self.session_timer = None
+
+    def is_unlocked(self):
+        with self.session_lock:
+            return self.session is not None
+
+    def get_stretched_key(self, password):
+        """ return the stretched seed. this tests the password """
+        return self.sequences[0].get_stretched_key( pw_decode(self.seed, password) )
+
+    def get_signing_key(self, password):
+        """ return the stretched seed, from the session if there is one """
+        with self.session_lock:
+            if self.session:
+                return self.session[0]
+        return self.get_stretched_key(password)
+
     def get_private_key(self, address, password):
         return self.get_private_keys([address], password).get(address)
 
     def get_private_keys(self, addresses, password):
-        # decode seed in any case, in order to test the password
-        seed = self.decode_seed(password)
+        # get the stretched seed in any case, in order to test the password
+        secexp = self.get_stretched_key(password)
+        return self.derive_private_keys(addresses, password, secexp, {})
+
+    def get_signing_keys(self, addresses, password, secexp=None):
+        """ the private keys used to sign; they come from the session if there is one """
+        if secexp is None:
+            secexp = self.get_signing_key(password)
+        with self.session_lock:
+            imported = dict(self.session[1]) if self.session else {}
+        return self.derive_private_keys(addresses, password, secexp, imported)
+
+    def derive_private_keys(self, addresses, password, secexp, imported):
         out = {}
-        l_sequences = []
-        l_addresses = []
         for address in addresses:
-            if address in self.imported_keys.keys():
-                out[address] = pw_decode( self.imported_keys[address], password )
+            if address in self.imported_keys:
+                sec = imported.get(address)
+                out[address] = sec if sec else pw_decode( self.imported_keys[address], password )
             else:
                 account, sequence = self.get_address_index(address)
                 if account == 0:
-                    l_sequences.append(sequence)
-                    l_addresses.append(address)
-
-        pk = self.sequences[0].get_private_keys(l_sequences, seed)
-        for i, address in enumerate(l_addresses): out[address] = pk[i]                     
+                    out[address] = self.sequences[0].get_private_key_from_stretched_exponent(sequence, secexp)
         return out
 
 
     def signrawtransaction(self, tx, input_info, private_keys, password):
         unspent_coins = self.get_unspent_coins()
-        seed = self.decode_seed(password)
+        secexp = self.get_signing_key(password)
 
         # convert private_keys to dict 
         pk = {}
@@ -268,8 +411,8 @@ class Wallet:
             # find the address:
             if txin.get('electrumKeyID'):
                 account, sequence = txin.get('electrumKeyID')
-                sec = self.sequences[account].get_private_key(sequence, seed)
-                addr = self.sequences[account].get_address(sequence)
+                sec = self.sequences[account].get_private_key_from_stretched_exponent(sequence, secexp)
+                addr = self.get_derived_keys(account, sequence)[1]
                 txin['address'] = addr
                 private_keys[addr] = sec
 
@@ -279,27 +422,38 @@ class Wallet:
             elif txin.get("raw_output_script"):
                 import deserialize
                 addr = deserialize.get_address_from_output_script(txin.get("raw_output_script").decode('hex'))
-                sec = self.get_private_key(addr, password)
+                sec = self.get_signing_keys([addr], password, secexp).get(addr)
                 if sec: 
                     private_keys[addr] = sec
                     txin['address'] = addr
 
-        tx.sign( private_keys )
+        self.sign_transaction(tx, private_keys)
+
+    def sign_transaction(self, tx, private_keys):
+        tx.sign( private_keys, verify = self.verify_signatures, processes = self.signing_processes )
 
     def sign_message(self, address, message, password):
-        sec = self.get_private_key(address, password)
+        sec = self.get_signing_keys([address], password).get(address)
         key = regenerate_key(sec)
         compressed = is_compressed(sec)
         return key.sign_message(message, compressed, address)
 
 
     def create_new_address(self, account, for_change):
+        return self.create_new_addresses(account, for_change, 1)[0]
+
+    def create_new_addresses(self, account, for_change, count):
         addresses = self.accounts[account][for_change]
         n = len(addresses)
-        address = self.get_new_address( account, for_change, n)
-        self.accounts[account][for_change].append(address)
-        self.history[address] = []
-        return address
+        new_addresses = []
+        for i, item in enumerate(self.sequences[account].get_keys(for_change, n, count)):
+            address = item[1]
+            self.derived_keys[ (account, for_change, n + i) ] = item
+            new_addresses.append(address)
+            self.accounts[account][for_change].append(address)
+            self.add_to_address_index(address, account, for_change, n + i)
+            self.history[address] = []
+        return new_addresses
         
 
     def get_new_address(self, account, for_change, n):
@@ -319,8 +473,9 @@ class Wallet:
                 addresses = account[0]
                 k = self.num_unused_trailing_addresses(addresses)
                 n = len(addresses) - k + value
-                addresses = addresses[0:n]
-                self.accounts[key][0] = addresses
+                for address in addresses[n:]:
+                    self.remove_from_address_index(address)
+                self.accounts[key][0] = addresses[0:n]
 
             self.gap_limit = value
             self.save()
@@ -370,16 +525,15 @@ class Wallet:
     def synchronize_sequence(self, account, for_change):
         limit = self.gap_limit_for_change if for_change else self.gap_limit
         addresses = self.accounts[account][for_change]
-        new_addresses = []
-        while True:
-            if len(addresses) < limit:
-                new_addresses.append( self.create_new_address(account, for_change) )
-                continue
-            if map( lambda a: self.address_is_old(a), addresses[-limit:] ) == limit*[False]:
+        # the last 'limit' addresses must be unused; derive the missing ones in one batch
+        k = 0
+        for address in addresses[::-1][:limit]:
+            if self.address_is_old(address):
                 break
-            else:
-                new_addresses.append( self.create_new_address(account, for_change) )
-        return new_addresses
+            k += 1
+        if k >= limit:
+            return []
+        return self.create_new_addresses(account, for_change, limit - k)
         
 
     def synchronize_account(self, account):
@@ -411,13 +565,13 @@ class Wallet:
 
 
     def get_address_flags(self, addr):
-        flags = "C" if self.is_change(addr) else "I" if addr in self.imported_keys.keys() else "-" 
+        flags = "C" if self.is_change(addr) else "I" if addr in self.imported_keys else "-" 
         flags += "F" if addr in self.frozen_addresses else "P" if addr in self.prioritized_addresses else "-"
         return flags
         
 
     def get_tx_value(self, tx, addresses=None):
-        if addresses is None: addresses = self.addresses(True)
+        if addresses is None: addresses = self.my_addresses
         return tx.get_value(addresses, self.prevout_values)
 
 
@@ -475,15 +629,65 @@ class Wallet:
         for item in tx.inputs:
             if self.is_mine(item.get('address')):
                 key = item['prevout_hash'] + ':%d'%item['prevout_n']
-                self.spent_outputs.append(key)
+                self.spent_outputs.add(key)
 
 
-    def get_addr_balance(self, address):
-        assert self.is_mine(address)
+    def get_tx_addresses(self, tx):
+        # addresses of the wallet that appear in a transaction
+        out = set()
+        for item in tx.inputs:
+            addr = item.get('address')
+            if self.is_mine(addr): out.add(addr)
+        for addr, value in tx.outputs:
+            if self.is_mine(addr): out.add(addr)
+        return out
+
+
+    def get_balance_bucket(self, address):
+        if address in self.imported_keys:
+            return self.imported_balance
+        account = self.address_index[address][0]
+        return self.account_balances.setdefault(account, [0, 0])
+
+
+    def clear_addr_balance(self, address):
+        # remove the contribution of an address from the cached totals. call with lock held
+        c, u = self.addr_balance.pop(address, (0, 0))
+        if c or u:
+            bucket = self.get_balance_bucket(address)
+            bucket[0] -= c
+            bucket[1] -= u
+            self.total_balance[0] -= c
+            self.total_balance[1] -= u
+        for key in self.addr_coins.pop(address, []):
+            self.utxo.pop(key, None)
+
+
+    def update_addr_balance(self, address):
+        c, u, coins = self.scan_addr_history(address)
+        with self.lock:
+            self.clear_addr_balance(address)
+            self.addr_balance[address] = (c, u)
+            bucket = self.get_balance_bucket(address)
+            bucket[0] += c
+            bucket[1] += u
+            self.total_balance[0] += c
+            self.total_balance[1] += u
+            keys = []
+            for coin in coins:
+                key = coin['tx_hash'] + ':%d' % coin['index']
+                self.utxo[key] = coin
+                keys.append(key)
+            self.addr_coins[address] = keys
+
+
+    def scan_addr_history(self, address):
+        # compute balance and unspent coins of an address from its history
         h = self.history.get(address,[])
-        if h == ['*']: return 0,0
+        if h == ['*']: return 0, 0, []
         c = u = 0
-        received_coins = []   # list of coins received at address
+        received_coins = set()   # coins received at address
+        coins = []
 
         for tx_hash, tx_height in h:
             tx = self.transactions.get(tx_hash)
@@ -493,7 +697,7 @@ class Wallet:
                 addr, value = item
                 if addr == address:
                     key = tx_hash + ':%d'%i
-                    received_coins.append(key)
+                    received_coins.add(key)
                 i +=1
 
         for tx_hash, tx_height in h:
@@ -521,54 +725,44 @@ class Wallet:
                 c += v
             else:
                 u += v
-        return c, u
+
+            for output in tx.d.get('outputs'):
+                if output.get('address') != address: continue
+                key = tx_hash + ":%d" % output.get('index')
+                if key in self.spent_outputs: continue
+                output['tx_hash'] = tx_hash
+                coins.append(output)
+
+        return c, u, coins
+
+    def get_addr_balance(self, address):
+        assert self.is_mine(address)
+        return self.addr_balance.get(address, (0, 0))
 
     def get_account_addresses(self, a):
         ac = self.accounts[a]
         return ac[0] + ac[1]
 
     def get_imported_balance(self):
-        cc = uu = 0
-        for addr in self.imported_keys.keys():
-            c, u = self.get_addr_balance(addr)
-            cc += c
-            uu += u
-        return cc, uu
+        with self.lock:
+            return tuple(self.imported_balance)
 
     def get_account_balance(self, account):
-        conf = unconf = 0
-        for addr in self.get_account_addresses(account): 
-            c, u = self.get_addr_balance(addr)
-            conf += c
-            unconf += u
-        return conf, unconf
+        with self.lock:
+            return tuple(self.account_balances.get(account, (0, 0)))
 
     def get_balance(self):
-        cc = uu = 0
-        for a in self.accounts.keys():
-            c, u = self.get_account_balance(a)
-            cc += c
-            uu += u
-        c, u = self.get_imported_balance()
-        cc += c
-        uu += u
-        return cc, uu
+        with self.lock:
+            return tuple(self.total_balance)
 
 
     def get_unspent_coins(self, domain=None):
         coins = []
         if domain is None: domain = self.addresses(True)
-        for addr in domain:
-            h = self.history.get(addr, [])
-            if h == ['*']: continue
-            for tx_hash, tx_height in h:
-                tx = self.transactions.get(tx_hash)
-                for output in tx.d.get('outputs'):
-                    if output.get('address') != addr: continue
-                    key = tx_hash + ":%d" % output.get('index')
-                    if key in self.spent_outputs: continue
-                    output['tx_hash'] = tx_hash
-                    coins.append(output)
+        with self.lock:
+            for addr in domain:
+                for key in self.addr_coins.get(addr, []):
+                    coins.append(self.utxo[key])
         return coins
 
 
@@ -641,6 +835,8 @@ class Wallet:
 
         with self.lock:
             self.transactions[tx_hash] = tx
+            self.tx_raw[tx_hash] = str(tx)
+            self.tx_summary[tx_hash] = tx.get_summary()
             self.tx_height[tx_hash] = tx_height
 
         #tx_height = tx.get('height')
@@ -648,6 +844,8 @@ class Wallet:
             self.verifier.add(tx_hash, tx_height)
 
         self.update_tx_outputs(tx_hash)
+        for addr in self.get_tx_addresses(tx):
+            self.update_addr_balance(addr)
 
         self.save()
 
@@ -661,6 +859,8 @@ class Wallet:
             self.history[addr] = hist
             self.save()
 
+        self.update_addr_balance(addr)
+
         if hist != ['*']:
             for tx_hash, tx_height in hist:
                 if tx_height>0:
@@ -765,18 +965,18 @@ class Wallet:
         for i in range(len(tx.inputs)):
             txin = tx.inputs[i]
             address = txin['address']
-            if address in self.imported_keys.keys(): 
+            if address in self.imported_keys: 
                 pk_addresses.append(address)
                 continue
             account, sequence = self.get_address_index(address)
             txin['electrumKeyID'] = (account, sequence) # used by the server to find the key
-            pk_addr, redeemScript = self.sequences[account].get_input_info(sequence)
+            pk_addr, redeemScript = self.get_input_info(account, sequence)
             if redeemScript: txin['redeemScript'] = redeemScript
             pk_addresses.append(pk_addr)
 
         # get all private keys at once.
-        private_keys = self.get_private_keys(pk_addresses, password)
-        tx.sign(private_keys)
+        private_keys = self.get_signing_keys(pk_addresses, password)
+        self.sign_transaction(tx, private_keys)
 
         for address, x in outputs:
             if address not in self.addressbook and not self.is_mine(address):
@@ -854,6 +1054,7 @@ class Wallet:
     def update_password(self, seed, old_password, new_password):
         if new_password == '': new_password = None
         self.use_encryption = (new_password != None)
+        self.lock_session()
         self.seed = pw_encode( seed, new_password)
         self.config.set_key('seed', self.seed, True)
         for k in self.imported_keys.keys():
@@ -990,10 +1191,6 @@ class Wallet:
             return False
 
     def save(self):
-        tx = {}
-        for k,v in self.transactions.items():
-            tx[k] = str(v)
-            
         s = {
             'use_encryption': self.use_encryption,
             'use_change': self.use_change,
@@ -1010,8 +1207,11 @@ class Wallet:
             'frozen_addresses': self.frozen_addresses,
             'prioritized_addresses': self.prioritized_addresses,
             'gap_limit': self.gap_limit,
-            'transactions': tx,
+            'transactions': self.tx_raw,
+            'tx_summary': self.tx_summary,
             'tx_height': self.tx_height,
+            'derived_keys': self.derived_keys,
+            'derived_keys_mpk': self.get_master_keys(),
         }
         for k, v in s.items():
             self.config.set_key(k,v)
@@ -1101,12 +1301,25 @@ class Wallet:
                     self.verifier.add(tx_hash, height)
                 else:
                     print_error("removing orphaned tx from history", tx_hash)
-                    self.transactions.pop(tx_hash)
+                    self.remove_tx(tx_hash)
 
         return True
 
 
 
+    def remove_tx(self, tx_hash):
+        with self.lock:
+            tx = self.transactions.pop(tx_hash)
+            self.tx_raw.pop(tx_hash, None)
+            self.tx_summary.pop(tx_hash, None)
+        for item in tx.inputs:
+            if self.is_mine(item.get('address')):
+                key = item['prevout_hash'] + ':%d'%item['prevout_n']
+                self.spent_outputs.discard(key)
+        for addr in self.get_tx_addresses(tx):
+            self.update_addr_balance(addr)
+
+
     def check_new_tx(self, tx_hash, tx):
         # 1 check that tx is referenced in addr_history. 
         addresses = []
@@ -1140,9 +1353,16 @@ class WalletSynchronizer(threading.Thread):
         self.interface.register_channel('synchronizer')
         self.wallet.interface.register_callback('connected', lambda: self.wallet.set_up_to_date(False))
         self.wallet.interface.register_callback('connected', lambda: self.interface.send([('server.banner',[])],'synchronizer') )
+        self.wallet.interface.register_callback('disconnected', self.clear_requested_histories)
         self.was_updated = True
         self.running = False
         self.lock = threading.Lock()
+        self.requested_histories = {}
+
+    def clear_requested_histories(self):
+        # their responses are lost. the statuses are sent again when we reconnect, and the histories requested again
+        with self.lock:
+            self.requested_histories = {}
 
     def stop(self):
         with self.lock: self.running = False
@@ -1171,6 +1391,8 @@ class WalletSynchronizer(threading.Thread):
     def subscribe_to_addresses(self, addresses):
         messages = []
         for addr in addresses:
+            # the interface only passes the statuses that differ from the stored history
+            self.interface.set_status('blockchain.address.subscribe', [addr], self.wallet.get_status(self.wallet.get_history(addr)))
             messages.append(('blockchain.address.subscribe', [addr]))
         self.interface.send( messages, 'synchronizer')
 
@@ -1180,7 +1402,6 @@ class WalletSynchronizer(threading.Thread):
 
         requested_tx = []
         missing_tx = []
-        requested_histories = {}
 
         # request any missing transactions
         for history in self.wallet.history.values():
@@ -1232,16 +1453,23 @@ class WalletSynchronizer(threading.Thread):
             if method == 'blockchain.address.subscribe':
                 addr = params[0]
                 if self.wallet.get_status(self.wallet.get_history(addr)) != result:
-                    if requested_histories.get(addr) is None:
-                        self.interface.send([('blockchain.address.get_history', [addr])], 'synchronizer')
-                        requested_histories[addr] = result
+                    with self.lock:
+                        if self.requested_histories.get(addr) is None:
+                            self.interface.send([('blockchain.address.get_history', [addr])], 'synchronizer')
+                            self.requested_histories[addr] = result
 
             elif method == 'blockchain.address.get_history':
                 addr = params[0]
                 print_error("receiving history", addr, result)
+                with self.lock:
+                    rs = self.requested_histories.pop(addr, None)
+                if rs is None:
+                    # requested before a disconnection: it is requested again
+                    continue
                 if result == ['*']:
-                    assert requested_histories.pop(addr) == '*'
+                    assert rs == '*'
                     self.wallet.receive_history_callback(addr, result)
+                    self.interface.set_status('blockchain.address.subscribe', [addr], '*')
                 else:
                     hist = []
                     # check that txids are unique
@@ -1256,12 +1484,12 @@ class WalletSynchronizer(threading.Thread):
                         raise BaseException("error: server sent history with non-unique txid", result)
 
                     # check that the status corresponds to what was announced
-                    rs = requested_histories.pop(addr)
                     if self.wallet.get_status(hist) != rs:
                         raise BaseException("error: status mismatch: %s"%addr)
                 
-                    # store received history
+                    # store received history, and tell the interface that we have this status
                     self.wallet.receive_history_callback(addr, hist)
+                    self.interface.set_status('blockchain.address.subscribe', [addr], rs)
 
                     # request transactions that we don't have 
                     for tx_hash, tx_height in hist:
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+#
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2013 thomasv@gitorious
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os, ast, threading
+from util import print_error
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+
+SQLITE_HEADER = 'SQLite format 3\0'
+
+
+def is_sqlite_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    except IOError:
+        return False
+
+
+def read_legacy_file(path):
+    """Read a wallet file written with repr(). Return None if it does not exist."""
+    try:
+        with open(path, "r") as f:
+            data = f.read()
+    except IOError:
+        return
+    try:
+        return ast.literal_eval( data )
+    except:
+        raise IOError("Cannot read wallet file.")
+
+
+def replace_file(path, tmp_path):
+    """Replace the wallet file at path with tmp_path, after a conversion.
+    The original file is kept as path.old (or path.old1, ...), and its name is returned."""
+    backup = path + '.old'
+    n = 0
+    while os.path.exists(backup):
+        n += 1
+        backup = path + '.old%d'%n
+    os.rename(path, backup)
+    os.rename(tmp_path, path)
+    print_error("the original wallet file was saved as", backup)
+    return backup
+
+
+
+class FileStorage:
+    """The original format: the whole wallet dict, written with repr().
+    A wallet in an sqlite database is read, and converted back on the first write."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        if is_sqlite_file(self.path):
+            if sqlite3 is None:
+                raise BaseException("The wallet file is an sqlite database, and sqlite3 is not available")
+            print_error("reading sqlite wallet file", self.path)
+            storage = SqliteStorage(self.path)
+            d = storage.read()
+            storage.conn.close()
+            return d
+        return read_legacy_file(self.path)
+
+    def write(self, d):
+        if is_sqlite_file(self.path):
+            print_error("converting wallet file from sqlite", self.path)
+            tmp_path = self.path + '.tmp'
+            self.write_file(tmp_path, d)
+            replace_file(self.path, tmp_path)
+            return
+        self.write_file(self.path, d)
+
+    def write_file(self, path, d):
+        s = repr(d)
+        f = open(path,"w")
+        f.write( s )
+        f.close()
+
+
+
+class SqliteStorage:
+    """
+Wallet storage in an sqlite database, with one record per key.
+Dictionaries are split into one record per item, so that a new
+transaction or history entry only writes that item. Keys and values
+are written with repr(), and read with ast.literal_eval, as in the
+legacy format. Only records that changed since the last
+write are committed, in a single transaction. A wallet in the legacy
+repr() format is read and converted on the first write; the original
+file is kept as a backup, with the .old extension.
+"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+        self.saved = {}       # key -> (value, data) for plain values, key -> {item: (value, data)} for dicts
+
+    def connect(self, create=False):
+        """open the database. the tables are only created in a new file, so that reading a wallet does not write to it"""
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.text_factory = str
+        if create:
+            with self.conn:
+                self.conn.execute("CREATE TABLE config (key TEXT PRIMARY KEY, value TEXT, is_dict INTEGER)")
+                self.conn.execute("CREATE TABLE items (key TEXT, item TEXT, value TEXT, PRIMARY KEY (key, item))")
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return
+
+        if not is_sqlite_file(self.path):
+            # legacy format; it will be converted by the next write
+            print_error("reading legacy wallet file", self.path)
+            return read_legacy_file(self.path)
+
+        with self.lock:
+            if self.conn is None:
+                self.connect()
+            d = {}
+            saved = {}
+            for key, value, is_dict in self.conn.execute("SELECT key, value, is_dict FROM config"):
+                k = ast.literal_eval(key)
+                if is_dict:
+                    d[k] = {}
+                    saved[k] = {}
+                else:
+                    v = ast.literal_eval(value)
+                    d[k] = v
+                    saved[k] = (v, value)
+            for key, item, value in self.conn.execute("SELECT key, item, value FROM items"):
+                k = ast.literal_eval(key)
+                i = ast.literal_eval(item)
+                v = ast.literal_eval(value)
+                d[k][i] = v
+                saved[k][i] = (v, value)
+            self.saved = saved
+        return d
+
+    def serialize(self, value, old):
+        # if we wrote this very object last time, it has not changed: strings are immutable,
+        # and the wallet does not modify tuples (derived keys, transaction summaries) in place
+        if old is not None and old[0] is value and type(value) in [str, unicode, int, long, bool, tuple]:
+            return old[1]
+        return repr(value)
+
+    def write(self, d):
+        with self.lock:
+            if self.conn is None:
+                if not os.path.exists(self.path):
+                    self.connect(True)
+                elif not is_sqlite_file(self.path):
+                    self.convert(d)
+                    return
+                else:
+                    self.connect()
+            self.write_changes(d)
+
+    def convert(self, d):
+        """Write a legacy wallet into a new database, then replace the old file, which is kept as a backup."""
+        print_error("converting wallet file to sqlite", self.path)
+        tmp_path = self.path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        path = self.path
+        self.path = tmp_path
+        self.connect(True)
+        self.write_changes(d)
+        self.conn.close()
+        self.path = path
+        replace_file(path, tmp_path)
+        self.connect()
+
+    def write_changes(self, d):
+        B = repr
+        saved = self.saved
+        new_saved = {}
+        config_rows = []
+        config_deleted = []
+        item_rows = []
+        item_deleted = []
+        items_cleared = []
+
+        for k, v in d.items():
+            old = saved.get(k)
+            if type(v) == dict:
+                if type(old) != dict:
+                    old = {}
+                    config_rows.append( (B(k), None, 1) )
+                    items_cleared.append(k)
+                new = {}
+                for i, vi in v.items():
+                    o = old.get(i)
+                    data = self.serialize(vi, o)
+                    if o is None or o[1] != data:
+                        item_rows.append( (B(k), B(i), data) )
+                    new[i] = (vi, data)
+                for i in old.keys():
+                    if i not in v:
+                        item_deleted.append( (B(k), B(i)) )
+                new_saved[k] = new
+            else:
+                if type(old) == dict:
+                    items_cleared.append(k)
+                    old = None
+                data = self.serialize(v, old)
+                if old is None or old[1] != data:
+                    config_rows.append( (B(k), data, 0) )
+                new_saved[k] = (v, data)
+
+        for k in saved.keys():
+            if k not in d:
+                config_deleted.append( (B(k),) )
+                items_cleared.append(k)
+
+        if not (config_rows or config_deleted or item_rows or item_deleted or items_cleared):
+            self.saved = new_saved
+            return
+
+        with self.conn:
+            self.conn.executemany("DELETE FROM items WHERE key=?", [ (B(k),) for k in items_cleared ])
+            self.conn.executemany("DELETE FROM config WHERE key=?", config_deleted)
+            self.conn.executemany("INSERT OR REPLACE INTO config VALUES (?,?,?)", config_rows)
+            self.conn.executemany("DELETE FROM items WHERE key=? AND item=?", item_deleted)
+            self.conn.executemany("INSERT OR REPLACE INTO items VALUES (?,?,?)", item_rows)
+        self.saved = new_saved
+
+
+
+def get_storage(path, backend=None):
+    """Return a storage object for the wallet file at path. backend is 'file' (the default) or 'sqlite'."""
+    if backend is None:
+        backend = 'file'
+    if backend == 'sqlite':
+        if sqlite3 is None:
+            raise BaseException("sqlite3 is not available")
+        return SqliteStorage(path)
+    elif backend == 'file':
+        return FileStorage(path)
+    else:
+        raise BaseException("Unknown wallet storage: %s"%backend)
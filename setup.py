@@ -53,15 +53,20 @@ setup(name = "Electrum",
                   'electrum.wallet_bitkey',
                   'electrum.wallet_factory',
                   'electrum.interface',
+                  'electrum.interface_pool',
+                  'electrum.transport',
                   'electrum.commands',
                   'electrum.mnemonic',
                   'electrum.simple_config',
+                  'electrum.wallet_storage',
                   'electrum.socks',
                   'electrum.msqr',
                   'electrum.util',
                   'electrum.bitcoin',
+                  'electrum.hashes',
                   'electrum.deserialize',
                   'electrum.verifier',
+                  'electrum.checkpoints',
                   'electrum_gui.gui_gtk',
                   'electrum_gui.qt_console',
                   'electrum_gui.gui_classic',